@@ -0,0 +1,677 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#-----------------------------------------------------------------------#
+# benchmark.py                                                          #
+#                                                                       #
+# Copyright (C) 2013 Germán A. Racca - <gracca[AT]gmail[DOT]com>        #
+#                                                                       #
+# This program is free software: you can redistribute it and/or modify  #
+# it under the terms of the GNU General Public License as published by  #
+# the Free Software Foundation, either version 3 of the License, or     #
+# (at your option) any later version.                                   #
+#                                                                       #
+# This program is distributed in the hope that it will be useful,       #
+# but WITHOUT ANY WARRANTY; without even the implied warranty of        #
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the          #
+# GNU General Public License for more details.                          #
+#                                                                       #
+# You should have received a copy of the GNU General Public License     #
+# along with this program. If not, see <http://www.gnu.org/licenses/>.  #
+#-----------------------------------------------------------------------#
+
+"""Benchmarks for pyAPOD against a local stand-in for the APOD web site.
+
+    ./benchmark.py                      list build, cold and warm cache
+    ./benchmark.py --suite jobs         list build for 1 to 16 downloads
+    ./benchmark.py --suite parse        page parser, BeautifulSoup if any,
+                                        over the pages in tests/pages
+    ./benchmark.py --suite search       search over 10000 cached entries
+    ./benchmark.py --suite snapshot     first paint from the saved list
+    ./benchmark.py --suite all --json results.json
+
+Each list build runs in its own process with its own empty HOME, so the
+cache starts cold and the memory peak is its own; the warm run reuses
+that HOME. Pages, icons and pictures are made up, unless --pages points
+to a directory laid out like the web site (apYYMMDD.html, calendar/,
+image/...), whose files are served as recorded and parsed by the parse
+suite. The parse suite reports the memory peak of each parser over
+what its own forked process had at the start. The snapshot suite times
+a new process from opening the cache to the rows and first icons of
+the list saved by a cold build, which should take under 200 ms for
+100 days.
+"""
+
+import os
+import sys
+import json
+import logging
+import time
+import zlib
+import random
+import shutil
+import resource
+import datetime
+import tempfile
+import threading
+import subprocess
+import collections
+import argparse
+import BaseHTTPServer
+import SocketServer
+from multiprocessing.pool import ThreadPool
+
+import pyAPOD
+from pyAPOD import GdkPixbuf, GLib, BLUE, RESET
+
+try:  # only to compare with the parser pyAPOD used before
+    from BeautifulSoup import BeautifulSoup
+except ImportError:
+    try:
+        from bs4 import BeautifulSoup
+    except ImportError:
+        BeautifulSoup = None
+
+
+PAGE = """<html>
+<head>
+<title> APOD: %(long)s - %(tit)s</title>
+</head>
+<body bgcolor="#F4F4FF" text="#000000">
+<center>
+<h1> Astronomy Picture of the Day </h1>
+<p>
+<a href="archivepix.html">Discover the cosmos!</a>
+Each day a different image or photograph of our fascinating universe is
+featured, along with a brief explanation written by a professional
+astronomer.
+<p>
+%(long)s
+<br>
+<a href="image/%(month)s/%(name)s.jpg">
+<IMG SRC="image/%(month)s/%(name)s_1024.jpg" style="max-width:100%%"></a>
+</center>
+
+<center>
+<b> %(tit)s </b> <br>
+<b> Image Credit &amp; Copyright: </b>
+<a href="http://example.org/">A. Astrophotographer</a>
+</center> <p>
+
+<b> Explanation: </b> %(inf)s
+<p> <center>
+<b> Tomorrow's picture: </b>open space
+<br>
+</center>
+</body>
+</html>
+"""
+
+PAGES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         'tests', 'pages')  # recorded pages of the site
+
+WORDS = ('nebula galaxy spiral comet moon eclipse aurora sun star cluster '
+         'dust gas planet saturn jupiter mars venus crater shadow light '
+         'milky way supernova remnant dark hydrogen telescope orbit ring '
+         'sky night horizon meteor shower volcano cloud storm jet black '
+         'hole infrared radio x-ray emission reflection globular').split()
+
+
+#############
+## C L A S S
+###########################
+class MockServerAPOD(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """Local stand-in for apod.nasa.gov"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, latency=0.0, bandwidth=None, gaps=0.0,
+                 archive_days=400, pages_dir=None, seed=1):
+        """Make up an archive of days, some of them without an APOD"""
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0),
+                                           MockHandlerAPOD)
+        self.latency = latency  # seconds before each response
+        self.bandwidth = bandwidth  # bytes per second per connection
+        self.pages_dir = pages_dir
+        self.counts = collections.Counter()
+        self.lock = threading.Lock()
+        rand = random.Random(seed)
+        today = datetime.date.today()
+        self.dates = [today - datetime.timedelta(days=i)
+                      for i in range(archive_days)]
+        self.gaps = set(date for date in self.dates[1:]
+                        if rand.random() < gaps)
+        self.titles = {}
+        for date in self.dates:
+            self.titles[date] = ' '.join(rand.sample(WORDS, 3)).title()
+        self.icon = self.make_jpeg(100, 100, rand)
+        self.picture = self.make_jpeg(1600, 1200, rand)
+
+    def make_jpeg(self, width, height, rand):
+        """Smooth noise encoded as JPEG, about the size of a photo"""
+        small_width = max(1, width / 16)
+        small_height = max(1, height / 16)
+        data = ''.join(chr(rand.randint(0, 255))
+                       for i in range(small_width * small_height * 3))
+        small = GdkPixbuf.Pixbuf.new_from_bytes(GLib.Bytes.new(data),
+                                                GdkPixbuf.Colorspace.RGB,
+                                                False, 8, small_width,
+                                                small_height, small_width * 3)
+        pxbf = small.scale_simple(width, height,
+                                  GdkPixbuf.InterpType.BILINEAR)
+        return pxbf.save_to_bufferv('jpeg', ['quality'], ['90'])[1]
+
+    def handle_error(self, request, client_address):
+        """Keep quiet about clients hanging up mid-response"""
+        pass
+
+    def get_url(self):
+        """Base url of the stand-in, to use as FetchAPOD.base_url"""
+        return 'http://127.0.0.1:%d/apod/' % self.server_address[1]
+
+    def start(self):
+        """Serve from a background thread"""
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def count(self, kind):
+        """Count a request of a kind"""
+        with self.lock:
+            self.counts[kind] = self.counts[kind] + 1
+
+    def get_counts(self):
+        """Copy of the request counters"""
+        with self.lock:
+            return collections.Counter(self.counts)
+
+    def get_body(self, path):
+        """Kind and body of the response for a path, None for a 404"""
+        path = path.split('?')[0]
+        if not path.startswith('/apod/'):
+            return 'missing', None
+        name = path[len('/apod/'):]
+        if self.pages_dir is not None:
+            recorded = os.path.join(self.pages_dir, name)
+            if os.path.isfile(recorded):
+                with open(recorded, 'rb') as rec:
+                    return 'recorded', rec.read()
+        if name == 'archivepix.html':
+            return 'archive', self.get_archive()
+        date = self.get_date(name)
+        if date is None or date in self.gaps:
+            return 'missing', None
+        if name.startswith('ap'):
+            return 'page', self.get_page(date)
+        if name.startswith('calendar/'):
+            return 'icon', self.icon
+        return 'picture', self.picture
+
+    def get_date(self, name):
+        """Date a file name is for, if it is in the archive"""
+        digits = ''.join(char for char in name if char.isdigit())[-6:]
+        try:
+            date = datetime.datetime.strptime(digits, '%y%m%d').date()
+        except ValueError:
+            return None
+        if date not in self.titles:
+            return None
+        return date
+
+    def get_page(self, date):
+        """APOD page of a date"""
+        rand = random.Random(date.toordinal())
+        inf = ' '.join(rand.choice(WORDS) for i in range(150))
+        return PAGE % {'long': date.strftime('%Y %B %d'),
+                       'tit': self.titles[date],
+                       'month': date.strftime('%y%m'),
+                       'name': 'picture' + date.strftime('%y%m%d'),
+                       'inf': inf}
+
+    def get_archive(self):
+        """Archive page listing every date with an APOD"""
+        lines = []
+        for date in self.dates:
+            if date not in self.gaps:
+                lines.append('%s:  <a href="ap%s.html">%s</a><br>' %
+                             (date.strftime('%Y %B %d'),
+                              date.strftime('%y%m%d'), self.titles[date]))
+        return ('<html><body><h1>Astronomy Picture of the Day Archive</h1>'
+                '\n<b>\n' + '\n'.join(lines) + '\n</b>\n</body></html>\n')
+
+
+#############
+## C L A S S
+###########################
+class MockHandlerAPOD(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Answer like the APOD web server, with validators and ranges"""
+
+    protocol_version = 'HTTP/1.1'
+    chunk_size = 8192
+
+    def log_message(self, *args):
+        """Keep quiet"""
+        pass
+
+    def do_GET(self):
+        """Send a file, a 304, a 206 or a 404"""
+        kind, body = self.server.get_body(self.path)
+        self.server.count(kind)
+        self.server.count('total')
+        time.sleep(self.server.latency)
+        if body is None:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        etag = '"%x"' % (zlib.crc32(body) & 0xffffffff)
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        start = 0
+        ranges = self.headers.get('Range')
+        if ranges and self.headers.get('If-Range', etag) == etag:
+            start = int(ranges.split('=')[1].split('-')[0])
+            self.send_response(206)
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(body) - start))
+        self.send_header('ETag', etag)
+        self.end_headers()
+        if self.command == 'GET':
+            self.send_body(body[start:])
+
+    do_HEAD = do_GET
+
+    def send_body(self, body):
+        """Write the body, no faster than the bandwidth limit"""
+        for offset in range(0, len(body), self.chunk_size):
+            chunk = body[offset:offset + self.chunk_size]
+            self.wfile.write(chunk)
+            if self.server.bandwidth:
+                time.sleep(float(len(chunk)) / self.server.bandwidth)
+
+
+#############
+## C L A S S
+###########################
+class ListAPOD:
+    """The list building parts of the window, without a display"""
+
+    def __init__(self, fetcher):
+        """Use the fetcher and cache of a FetchAPOD"""
+        self.fetcher = fetcher
+        self.cache = fetcher.cache
+
+    def build(self, days, icon_size):
+        """Rows and icons for a number of days, as the window loads them;
+        return the rows and the seconds to the first row and to all icons"""
+        fetcher = self.fetcher
+        pool = ThreadPool(max(1, fetcher.jobs))
+        start = time.time()
+        first = None
+        rows = []
+        icons = []
+        try:
+            for apod_list in fetcher.iter_apod_data(days, fetcher.jobs):
+                if first is None:
+                    first = time.time() - start
+                rows.append(apod_list)
+                icons.append(pool.apply_async(fetcher.get_thumbnail,
+                                              (apod_list[2],
+                                               fetcher.cache_dir, icon_size)))
+            for icon in icons:
+                icon.get()
+        finally:
+            pool.terminate()
+        return rows, first, time.time() - start
+
+    def open(self, img):
+        """Download and decode a picture as the Open button does; return
+        the seconds it took"""
+        tmp_name = os.path.join(self.fetcher.cache_dir, img.split('/')[-1])
+        start = time.time()
+        tmp_name = self.fetcher.http.fetch_file(img, tmp_name)
+        pyAPOD.PreviewAPOD(self.cache).get_preview(tmp_name)
+        return time.time() - start
+
+
+# benchmark suites
+#------------------
+def run_child(args):
+    """Build the list in this process and print the numbers as JSON"""
+    logging.basicConfig(format='%(message)s', level=logging.WARNING)
+    pyAPOD.FetchAPOD.base_url = args.url
+    fetcher = pyAPOD.FetchAPOD(pyAPOD.SettingsAPOD.get_instance())
+    fetcher.jobs = args.jobs
+    window = ListAPOD(fetcher)
+    rows, first, built = window.build(args.days[0], args.icon_size)
+    opened = None
+    if rows:
+        opened = window.open(rows[0][1])
+    fetcher.save_snapshot(rows, args.icon_size)  # as at exit
+    fetcher.cache.flush()
+    counters = pyAPOD.stats.counters
+    print json.dumps({'rows': len(rows), 'first_row': first,
+                      'list': built, 'open': opened,
+                      'peak_kib': resource.getrusage(
+                          resource.RUSAGE_SELF).ru_maxrss,
+                      'bytes': counters['bytes'],
+                      'page_hits': counters['page hits'],
+                      'file_hits': counters['file hits']})
+    return 0
+
+
+def run_paint(args):
+    """Fill the list from the snapshot in this process, as the window
+    does before its first paint, and print the numbers as JSON"""
+    logging.basicConfig(format='%(message)s', level=logging.WARNING)
+    pyAPOD.FetchAPOD.base_url = args.url
+    start = time.time()
+    fetcher = pyAPOD.FetchAPOD(pyAPOD.SettingsAPOD.get_instance())
+    rows = fetcher.load_snapshot(args.days[0], args.icon_size,
+                                 2 * pyAPOD.ThumbnailerAPOD.margin)
+    painted = time.time() - start
+    print json.dumps({'rows': len(rows), 'paint': painted,
+                      'icons': len([pxbf for item, pxbf in rows
+                                    if pxbf is not None]),
+                      'peak_kib': resource.getrusage(
+                          resource.RUSAGE_SELF).ru_maxrss})
+    return 0
+
+
+def spawn(server, home, days, jobs, icon_size, paint=False):
+    """Run a list build, or a first paint, in a child process with its
+    own HOME"""
+    before = server.get_counts()
+    cmd = [sys.executable, os.path.abspath(__file__), '--child',
+           '--url', server.get_url(), '--days', str(days),
+           '--jobs', str(jobs), '--icon-size', str(icon_size)]
+    if paint:
+        cmd.append('--paint')
+    env = dict(os.environ, HOME=home)
+    child = subprocess.Popen(cmd, env=env, stdout=subprocess.PIPE)
+    output = child.communicate()[0]
+    if child.returncode:
+        raise RuntimeError('benchmark process failed: ' + ' '.join(cmd))
+    result = json.loads(output.strip().splitlines()[-1])
+    requests = server.get_counts()
+    requests.subtract(before)
+    result['requests'] = requests['total']
+    result['requests_by_kind'] = dict((kind, count) for kind, count
+                                      in requests.items()
+                                      if count and kind != 'total')
+    return result
+
+
+def print_row(cells, widths):
+    """Print a row of a table"""
+    print '  '.join(str(cell).rjust(width)
+                    for cell, width in zip(cells, widths))
+
+
+def print_title(title):
+    """Print the title of a suite"""
+    print
+    print "[ " + BLUE + "benchmark" + RESET + " ]", title
+
+
+def get_ms(seconds):
+    """Milliseconds to show for seconds, or '-'"""
+    if seconds is None:
+        return '-'
+    return '%.0f' % (seconds * 1000)
+
+
+def bench_list(server, args):
+    """Build the list for each number of days, cold then warm"""
+    print_title('list build, %d jobs' % args.jobs)
+    widths = (5, 5, 5, 10, 8, 8, 9, 9, 10)
+    print_row(('days', 'cache', 'rows', 'first ms', 'list ms', 'open ms',
+               'requests', 'peak KiB', 'bytes'), widths)
+    results = []
+    for days in args.days:
+        home = tempfile.mkdtemp(prefix='pyapod-bench-')
+        try:
+            for cache in ('cold', 'warm'):
+                result = spawn(server, home, days, args.jobs, args.icon_size)
+                result.update({'days': days, 'cache': cache,
+                               'jobs': args.jobs})
+                results.append(result)
+                print_row((days, cache, result['rows'],
+                           get_ms(result['first_row']),
+                           get_ms(result['list']), get_ms(result['open']),
+                           result['requests'], result['peak_kib'],
+                           result['bytes']), widths)
+        finally:
+            shutil.rmtree(home)
+    return results
+
+
+def bench_jobs(server, args):
+    """Build the list with a cold cache for several download counts"""
+    days = max(args.days)
+    print_title('cold list build of %d days by parallel downloads' % days)
+    widths = (5, 10, 8, 9)
+    print_row(('jobs', 'first ms', 'list ms', 'requests'), widths)
+    results = []
+    for jobs in (1, 2, 4, 8, 16):
+        home = tempfile.mkdtemp(prefix='pyapod-bench-')
+        try:
+            result = spawn(server, home, days, jobs, args.icon_size)
+        finally:
+            shutil.rmtree(home)
+        result.update({'days': days, 'cache': 'cold', 'jobs': jobs})
+        results.append(result)
+        print_row((jobs, get_ms(result['first_row']), get_ms(result['list']),
+                   result['requests']), widths)
+    return results
+
+
+def bench_snapshot(server, args):
+    """Time the first paint from the snapshot of a cold build"""
+    print_title('first paint from the snapshot, target 200 ms')
+    widths = (5, 5, 6, 9, 9, 9)
+    print_row(('days', 'rows', 'icons', 'paint ms', 'requests', 'peak KiB'),
+              widths)
+    results = []
+    for days in args.days:
+        home = tempfile.mkdtemp(prefix='pyapod-bench-')
+        try:
+            spawn(server, home, days, args.jobs, args.icon_size)
+            result = spawn(server, home, days, args.jobs, args.icon_size,
+                           paint=True)
+        finally:
+            shutil.rmtree(home)
+        result.update({'days': days})
+        results.append(result)
+        print_row((days, result['rows'], result['icons'],
+                   get_ms(result['paint']), result['requests'],
+                   result['peak_kib']), widths)
+    return results
+
+
+def parse_soup(path):
+    """Parse a page the way pyAPOD did with BeautifulSoup, all read at
+    once"""
+    with open(path, 'rb') as page:
+        soup = BeautifulSoup(page.read())
+    tag_a = soup.findAll('a')
+    tag_b = soup.findAll('b')
+    tag_p = soup.findAll('p')
+    return tag_b[0].string.strip(), tag_a[1]['href'], str(tag_p[2])
+
+
+def parse_stream(path):
+    """Parse a page with the streaming parser, read in chunks"""
+    with open(path, 'rb') as page:
+        try:
+            return pyAPOD.PageParserAPOD().parse(page)
+        except pyAPOD.PageErrorAPOD:  # the video days
+            return None
+
+
+def measure_parse(parse, pages, repeats):
+    """Seconds per page and KiB of memory peak over the start, measured in
+    a forked process so that each parser has a peak of its own"""
+    read_end, write_end = os.pipe()
+    pid = os.fork()
+    if not pid:
+        os.close(read_end)
+        for path in pages:  # imports and caches are not the parse
+            parse(path)
+        start_kib = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        start = time.time()
+        for repeat in range(repeats):
+            for path in pages:
+                parse(path)
+        per_page = (time.time() - start) / (repeats * len(pages))
+        peak_kib = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        os.write(write_end, json.dumps([per_page, peak_kib - start_kib]))
+        os._exit(0)
+    os.close(write_end)
+    with os.fdopen(read_end) as reader:
+        result = reader.read()
+    os.waitpid(pid, 0)
+    return json.loads(result)
+
+
+def get_pages(args):
+    """Recorded pages to parse: those of --pages, else the test pages"""
+    pages_dir = args.pages or PAGES_DIR
+    return sorted(os.path.join(pages_dir, name)
+                  for name in os.listdir(pages_dir)
+                  if name.startswith('ap') and name.endswith('.html'))
+
+
+def bench_parse(server, args):
+    """Time the page parsers over recorded pages, with their memory peak"""
+    pages = get_pages(args)
+    print_title('parse of %d recorded pages' % len(pages))
+    parsers = [('HTMLParser', parse_stream)]
+    if BeautifulSoup is not None:
+        parsers.append(('BeautifulSoup', parse_soup))
+    widths = (14, 12, 10)
+    print_row(('parser', 'ms per page', 'peak KiB'), widths)
+    results = []
+    for name, parse in parsers:
+        per_page, peak_kib = measure_parse(parse, pages, 200)
+        results.append({'parser': name, 'ms_per_page': per_page * 1000,
+                        'peak_kib': peak_kib})
+        print_row((name, '%.2f' % (per_page * 1000), peak_kib), widths)
+    return results
+
+
+def bench_search(server, args):
+    """Time searches over 10000 cached entries, indexed and not"""
+    cache_dir = tempfile.mkdtemp(prefix='pyapod-bench-')
+    try:
+        meta_cache = pyAPOD.MetaCacheAPOD(cache_dir)
+        meta_cache.conn.execute('PRAGMA synchronous = OFF')  # fast setup
+        rand = random.Random(args.seed)
+        today = datetime.date.today()
+        for i in range(10000):
+            date = today - datetime.timedelta(days=i)
+            inf = ' '.join(rand.choice(WORDS) for word in range(100))
+            inf = inf + ' NGC %d' % rand.randint(1, 7840)  # a rare word
+            meta_cache.put(date, [date.strftime('%Y %h %d'), 'img', 'ico',
+                                  ' '.join(rand.sample(WORDS, 3)), inf])
+        print_title('search over 10000 entries (%s)' %
+                    meta_cache.search_module)
+        widths = (16, 8, 10, 10)
+        print_row(('query', 'matches', 'index ms', 'LIKE ms'), widths)
+        results = []
+        module = meta_cache.search_module
+        for query in ('ngc 1976', 'ngc 19', 'spiral galaxy', 'gal'):
+            times = []
+            for search_module in (module, None):
+                meta_cache.search_module = search_module
+                start = time.time()
+                for repeat in range(10):
+                    matches = len(meta_cache.search(query))
+                times.append((time.time() - start) / 10)
+            meta_cache.search_module = module
+            results.append({'query': query, 'matches': matches,
+                            'index': times[0], 'like': times[1]})
+            print_row((query, matches, get_ms(times[0]), get_ms(times[1])),
+                      widths)
+        return results
+    finally:
+        shutil.rmtree(cache_dir)
+
+
+def parse_days(text):
+    """List of day counts from '7,30,100'"""
+    try:
+        return [int(days) for days in text.split(',')]
+    except ValueError:
+        raise argparse.ArgumentTypeError('not a list of numbers: ' + text)
+
+
+def main():
+    """Start the stand-in and run the suites asked for"""
+    parser = argparse.ArgumentParser(
+        description='Benchmark pyAPOD against a local APOD stand-in.')
+    parser.add_argument('--suite', default='list',
+                        choices=('list', 'jobs', 'parse', 'search',
+                                 'snapshot', 'all'),
+                        help='what to measure (default list)')
+    parser.add_argument('--days', type=parse_days, default=[7, 30, 100],
+                        metavar='N,N',
+                        help='days in the list (default 7,30,100)')
+    parser.add_argument('--jobs', type=int, default=8, metavar='N',
+                        help='parallel downloads (default 8)')
+    parser.add_argument('--icon-size', type=int, default=50, metavar='PX',
+                        help='icon size (default 50)')
+    parser.add_argument('--latency', type=float, default=50, metavar='MS',
+                        help='delay before each response (default 50)')
+    parser.add_argument('--bandwidth', type=float, metavar='KIB',
+                        help='KiB/s per connection (default no limit)')
+    parser.add_argument('--gaps', type=float, default=0.05,
+                        metavar='FRACTION',
+                        help='days without an APOD, answered with 404 '
+                             '(default 0.05)')
+    parser.add_argument('--pages', metavar='DIR',
+                        help='serve recorded files from this directory')
+    parser.add_argument('--seed', type=int, default=1,
+                        help='seed of the made up archive (default 1)')
+    parser.add_argument('--json', metavar='FILE',
+                        help='also write the results to a JSON file')
+    parser.add_argument('--child', action='store_true',
+                        help=argparse.SUPPRESS)
+    parser.add_argument('--url', help=argparse.SUPPRESS)
+    parser.add_argument('--paint', action='store_true',
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child and args.paint:
+        return run_paint(args)
+    if args.child:
+        return run_child(args)
+
+    bandwidth = None
+    if args.bandwidth:
+        bandwidth = args.bandwidth * 1024
+    server = MockServerAPOD(args.latency / 1000.0, bandwidth, args.gaps,
+                            max(args.days) * 2 + 30, args.pages, args.seed)
+    server.start()
+    suites = [('list', bench_list), ('jobs', bench_jobs),
+              ('parse', bench_parse), ('search', bench_search),
+              ('snapshot', bench_snapshot)]
+    results = {'latency_ms': args.latency, 'bandwidth_kib': args.bandwidth,
+               'gaps': args.gaps}
+    for name, bench in suites:
+        if args.suite in (name, 'all'):
+            results[name] = bench(server, args)
+    server.shutdown()
+    if args.json:
+        with open(args.json, 'w') as out:
+            json.dump(results, out, indent=2, sort_keys=True)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
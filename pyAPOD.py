@@ -25,18 +25,72 @@ __copyright__ = "Copyright (C) 2013, Germán A. Racca"
 __email__ = "gracca@gmail.com"
 __license__ = "GPLv3+"
 __version__ = "0.1"
+RED = '\033[0;31m'
 GREEN = '\033[0;32m'
 BLUE = '\033[0;34m'
 RESET = '\033[0m'
 
 
 import os
+import re
+import cgi
+import sys
+import fcntl
+import json
+import math
+import time
+import socket
+import shutil
+import sqlite3
+import hashlib
+import httplib
 import urllib2
+import urlparse
+import tempfile
 import datetime
+import threading
+import Queue
+import logging
+import HTMLParser
+import contextlib
+import collections
+import argparse
+import SocketServer
 import ConfigParser
+from email.utils import formatdate
+from multiprocessing.pool import ThreadPool
 
-from BeautifulSoup import BeautifulSoup
-from gi.repository import Gtk, GdkPixbuf
+
+#############
+## C L A S S
+###########################
+class MissingAPOD:
+    """Stand-in for the GI bindings when they are not installed: the window
+    classes can still be defined, but not built"""
+
+    def __init__(self, error):
+        """Remember why the bindings are missing"""
+        self.error = error
+        self.classes = {}
+
+    def __getattr__(self, name):
+        """A class that raises the import error when built; an exception
+        class, so that except clauses naming it still work"""
+        if name not in self.classes:
+            error = self.error
+
+            class Missing(Exception):
+                def __init__(self, *args, **kwargs):
+                    raise ImportError(error)
+            self.classes[name] = Missing
+        return self.classes[name]
+
+try:  # the window needs GTK, --mirror, --search and --serve-cache do not
+    from gi.repository import Gtk, Gdk, GdkPixbuf, GLib, GObject
+except ImportError as err:
+    Gtk = Gdk = GdkPixbuf = GLib = GObject = MissingAPOD(err)
+
+log = logging.getLogger('pyAPOD')
 
 
 #############
@@ -45,6 +99,8 @@ from gi.repository import Gtk, GdkPixbuf
 class APOD(Gtk.Window):
     """Gtk+ 3 interface for pyAPOD"""
 
+    new_day_interval = 600  # seconds between checks for a new APOD
+
     def __init__(self):
         """Initialize the window"""
         Gtk.Window.__init__(self, title='Astronomy Picture of the Day')
@@ -66,34 +122,52 @@ class APOD(Gtk.Window):
                                        Gtk.PolicyType.AUTOMATIC)
         self.grid.add(self.scrolledwindow)
 
+        # create a search entry above the list
+        #--------------------------------------
+        self.searchentry = Gtk.SearchEntry()
+        self.searchentry.connect('search-changed', self.on_search_changed)
+        self.grid.attach_next_to(self.searchentry, self.scrolledwindow,
+                                 Gtk.PositionType.TOP, 1, 1)
+
         # read settings from config file
         #--------------------------------
-        apod_settings = SettingsAPOD()
-        days_numb, icon_size = apod_settings.get_settings()
-        print "[ " + BLUE + "settings" + RESET + " ]" + \
-              " icon size =", icon_size
-        print "[ " + BLUE + "settings" + RESET + " ]" + \
-              " number of days =", days_numb
+        self.settings = SettingsAPOD.get_instance()
+        days_numb, icon_size = self.settings.get_settings()
+        self.fetcher = FetchAPOD(self.settings)
+        log.info("[ settings ] icon size = %s", icon_size)
+        log.info("[ settings ] number of days = %s", days_numb)
+        log.info("[ settings ] parallel downloads = %s", self.fetcher.jobs)
 
         # get cache directory to store images
         #-------------------------------------
-        cache_dir = self.get_cache_dir()
-
-        # get apod data for last 'days_numb' days
+        cache_dir = self.fetcher.cache_dir
+        self.cache = self.fetcher.cache
+        self.preview = PreviewAPOD(self.cache)
+        self.prefetch = self.settings.get_option('prefetch')
+        prefetch_jobs = self.settings.get_option('prefetch_jobs')
+        self.prefetcher = PrefetchAPOD(self.fetcher, self.preview,
+                                       prefetch_jobs)
+
+        # create an empty list store: icon, title, date, picture
+        #--------------------------------------------------------
+        self.get_liststore()
+
+        # show only the rows matching the search
         #-----------------------------------------
-        apod_data = self.get_apod_data(days_numb)
-
-        # create a list store: icon, title, date, picture
-        #-------------------------------------------------
-        self.get_liststore(apod_data, cache_dir, icon_size)
+        self.search_dates = None  # dates of the matches, None for all
+        self.filter = self.liststore.filter_new()
+        self.filter.set_visible_func(self.filter_row)
 
         # create the tree view
         #----------------------
-        self.treeview = Gtk.TreeView(model=self.liststore)
+        self.treeview = Gtk.TreeView(model=self.filter)
         self.treeview.set_hexpand(True)
         self.treeview.set_vexpand(True)
         self.treeview.set_headers_visible(False)
         self.treeview.set_tooltip_column(2)
+        selection = self.treeview.get_selection()
+        selection.set_mode(Gtk.SelectionMode.MULTIPLE)  # ranges to export
+        selection.connect('changed', self.on_selection_changed)
 
         # create the columns for the tree view
         #--------------------------------------
@@ -110,7 +184,54 @@ class APOD(Gtk.Window):
         column_text.set_alignment(0.5)
         self.treeview.append_column(column_text)
 
-        self.scrolledwindow.add_with_viewport(self.treeview)
+        self.scrolledwindow.add(self.treeview)
+
+        # load thumbnails only for the rows in view
+        #-------------------------------------------
+        self.thumbnailer = ThumbnailerAPOD(self, self.fetcher.jobs)
+        self.thumbs_scheduled = False
+        vadjustment = self.scrolledwindow.get_vadjustment()
+        vadjustment.connect('value-changed', self.on_view_changed)
+        vadjustment.connect('changed', self.on_view_changed)
+
+        # create the progress bar for background loads
+        #-----------------------------------------------
+        self.progressbox = Gtk.Box(spacing=10)
+        self.progressbox.set_no_show_all(True)
+
+        self.progressbar = Gtk.ProgressBar(show_text=True)
+        self.progressbar.set_valign(Gtk.Align.CENTER)
+        self.progressbox.pack_start(self.progressbar, True, True, 0)
+
+        self.button_cancel = Gtk.Button(stock=Gtk.STOCK_CANCEL)
+        self.button_cancel.connect('clicked', self.on_button_cancel_clicked)
+        self.progressbox.pack_start(self.button_cancel, False, False, 0)
+
+        self.grid.attach(self.progressbox, 0, 1, 1, 1)
+
+        # create the progress bar for picture downloads
+        #-----------------------------------------------
+        self.downloadbar = Gtk.ProgressBar(show_text=True)
+        self.downloadbar.set_no_show_all(True)
+        self.grid.attach(self.downloadbar, 0, 2, 1, 1)
+        self.download = None  # url shown in the download bar
+
+        # create the progress bar for exports
+        #-------------------------------------
+        self.exportbox = Gtk.Box(spacing=10)
+        self.exportbox.set_no_show_all(True)
+
+        self.exportbar = Gtk.ProgressBar(show_text=True)
+        self.exportbar.set_valign(Gtk.Align.CENTER)
+        self.exportbox.pack_start(self.exportbar, True, True, 0)
+
+        self.button_export_cancel = Gtk.Button(stock=Gtk.STOCK_CANCEL)
+        self.button_export_cancel.connect('clicked',
+                                          self.on_button_export_cancel_clicked)
+        self.exportbox.pack_start(self.button_export_cancel, False, False, 0)
+
+        self.grid.attach(self.exportbox, 0, 3, 1, 1)
+        self.exporter = None
 
         # create the buttons
         #--------------------
@@ -129,122 +250,386 @@ class APOD(Gtk.Window):
         self.buttonbox.set_child_secondary(self.button_prefs,
                                            is_secondary=True)
 
+        self.button_export = Gtk.Button.new_with_mnemonic('_Export')
+        self.button_export.connect('clicked', self.on_button_export_clicked)
+        self.buttonbox.add(self.button_export)
+
         self.button_open = Gtk.Button(stock=Gtk.STOCK_OPEN)
         self.button_open.connect('clicked', self.on_button_open_clicked,
                                  cache_dir)
         self.buttonbox.add(self.button_open)
 
-        self.grid.attach(self.buttonbox, 0, 1, 1, 1)
-
-    # functions to fetch APOD data
-    #------------------------------
-    def get_apod_data(self, num):
-        """List of APOD data for a number of dates"""
-        date = datetime.date.today()
-        apod_data = []
-        i = 0
-        while i < num:
-            apod_list = self.get_apod_list(date)  # get data for that date
-            if apod_list is not False:
-                apod_data.append(apod_list)
-                i = i + 1
-                date = date - datetime.timedelta(days=1)
-            else:
-                date = date - datetime.timedelta(days=1)  # try the day before
-        return apod_data
-
-    def get_apod_list(self, date):
-        """Fetch APOD data for a given date"""
-        icon = "calendar/S_" + date.strftime('%y%m%d') + ".jpg"
-        page = "ap" + date.strftime('%y%m%d') + ".html"
-        base_url = "http://apod.nasa.gov/apod/"
-        apod_url = base_url + page
-
-        # fetch the web page
-        try:
-            apod_htm = urllib2.urlopen(apod_url).read()
-        except urllib2.HTTPError:
-            return False
-
-        # get the soup and tags
-        soup = BeautifulSoup(apod_htm)
-        tag_a = soup.findAll('a')
-        tag_b = soup.findAll('b')
-        tag_p = soup.findAll('p')
-
-        # extract title and picture
-        apod_tit = tag_b[0].string.strip()
-        apod_pic = tag_a[1]['href']
-        apod_inf = str(tag_p[2])
-        apod_img = base_url + apod_pic
-        apod_ico = base_url + icon
+        self.grid.attach(self.buttonbox, 0, 4, 1, 1)
+
+        # load apod data for last 'days_numb' days in the background
+        #-------------------------------------------------------------
+        self.loader = None
+        self.days_numb = days_numb
+        self.icon_size = icon_size
+        self.cache_dir = cache_dir
+        self.placeholder = self.get_placeholder(icon_size)
+        if self.load_snapshot():  # last list shown, then look for news
+            self.resize_list(days_numb)
+            self.check_new_day()
+        else:
+            self.start_loader(days_numb)
 
-        # fromat date
-        apod_dat = date.strftime('%Y %h %d')
+        # look for a new APOD now and then
+        #----------------------------------
+        GLib.timeout_add_seconds(self.new_day_interval, self.check_new_day)
 
-        return [apod_dat, apod_img, apod_ico, apod_tit, apod_inf]
+        # follow changes of the settings, made here or in the file
+        #----------------------------------------------------------
+        self.settings.subscribe(self.on_settings_changed)
+        self.settings.watch()
 
-    # function to get cache directory
+    # functions to create a liststore
     #---------------------------------
-    def get_cache_dir(self):
-        """Create cache directory if it doesn't exist"""
-        home = os.environ.get('HOME')
-        cache = os.path.join('.cache', 'pyAPOD')
-        if os.path.isdir(os.path.join(home, cache)):
-            return os.path.join(home, cache)
+    def get_liststore(self):
+        """Create an empty liststore: icon, title, date, picture, info,
+        icon url and size of the loaded icon (0 for the placeholder)"""
+        self.liststore = Gtk.ListStore(GdkPixbuf.Pixbuf, str, str, str, str,
+                                       str, int)
+
+    def get_liststore_row(self, item):
+        """Liststore row for APOD data, with a placeholder icon"""
+        dat = item[0]
+        img = item[1]
+        ico = item[2]
+        tit = item[3]
+        inf = item[4]
+        return [self.placeholder, tit, dat, img, inf, ico, 0]
+
+    def get_row_date(self, row):
+        """Date of a liststore row"""
+        return self.fetcher.get_apod_date([row[2]])
+
+    def get_placeholder(self, icon_size):
+        """Blank pixbuf shown until the real icon is loaded"""
+        pxbf = GdkPixbuf.Pixbuf.new(GdkPixbuf.Colorspace.RGB, True, 8,
+                                    icon_size, icon_size)
+        pxbf.fill(0)
+        return pxbf
+
+    # functions to load the liststore in the background
+    #---------------------------------------------------
+    def start_loader(self, num, start=None):
+        """Cancel any load in progress and append rows for num days"""
+        if self.loader is not None:
+            self.loader.cancel()
+        self.loader = LoaderAPOD(self, self.liststore, num, start)
+        self.progressbar.set_fraction(0)
+        self.progressbar.set_text('Loading ' + str(num) + ' days')
+        self.progressbox.show_all()
+        self.loader.start()
+
+    def on_load_progress(self, done, total):
+        """Update the progress bar, called from the main loop"""
+        self.progressbar.set_fraction(float(done) / total)
+        self.progressbar.set_text('Loaded ' + str(done) + ' of ' + str(total))
+
+    def on_load_finished(self, error):
+        """Hide the progress bar, called from the main loop"""
+        if error is not None:
+            log.warning("[ load failed ] %s", error)
+        self.loader = None
+        self.progressbox.hide()
+        while len(self.liststore) > self.days_numb:  # new days came on top
+            self.liststore.remove(self.liststore.get_iter(self.days_numb))
+
+    # functions to save and restore the list between runs
+    #------------------------------------------------------
+    def save_snapshot(self):
+        """Store the rows shown, with their scaled icons, for next launch"""
+        if len(self.liststore):
+            self.fetcher.save_snapshot([[row[2], row[3], row[5], row[1],
+                                         row[4]] for row in self.liststore],
+                                       self.icon_size)
+
+    def load_snapshot(self):
+        """Fill the list from the last snapshot, True if there was one"""
+        with stats.timer('snapshot'):
+            # decode the icons of the first screen right away
+            rows = self.fetcher.load_snapshot(self.days_numb, self.icon_size,
+                                              2 * self.thumbnailer.margin)
+            for item, pxbf in rows:
+                row = self.get_liststore_row(item)
+                if pxbf is not None:
+                    row[0] = pxbf
+                    row[6] = self.icon_size
+                self.liststore.append(row)
+        return len(self.liststore) > 0
+
+    # functions to update the liststore in place
+    #--------------------------------------------
+    def resize_list(self, days_numb):
+        """Append older rows or drop the oldest to show a number of days"""
+        self.days_numb = days_numb
+        if self.loader is not None:  # an unfinished load goes on below
+            self.loader.cancel()
+            self.loader = None
+            self.progressbox.hide()
+        while len(self.liststore) > days_numb:
+            self.liststore.remove(self.liststore.get_iter(days_numb))
+        count = len(self.liststore)
+        if count < days_numb:
+            start = None
+            if count:  # continue from the day before the oldest row
+                oldest = self.get_row_date(self.liststore[count - 1])
+                start = oldest - datetime.timedelta(days=1)
+            self.start_loader(days_numb - count, start)
+
+    def rescale_thumbs(self, icon_size):
+        """Switch to a new icon size, rescaling icons already downloaded"""
+        self.icon_size = icon_size
+        self.placeholder = self.get_placeholder(icon_size)
+        for row in self.liststore:
+            if not row[6]:
+                row[0] = self.placeholder
+        self.on_view_changed()  # old icons stay until rescaled
+
+    def check_new_day(self):
+        """Look for APODs newer than the newest row"""
+        if not self.loading_newest() and len(self.liststore):
+            newest = self.get_row_date(self.liststore[0])
+            days = (datetime.date.today() - newest).days
+            if days > 0:
+                task = TaskAPOD(self.fetcher.get_apod_newer,
+                                (newest, min(days, self.days_numb),
+                                 self.fetcher.jobs),
+                                self.prepend_rows, self.on_new_day_error)
+                task.start()
+        return True  # keep checking
+
+    def loading_newest(self):
+        """Whether a load from today is in progress"""
+        return self.loader is not None and self.loader.start_date is None
+
+    def prepend_rows(self, apod_data):
+        """Put new APODs on top, dropping the oldest rows"""
+        if self.loading_newest() or not len(self.liststore):
+            return
+        newest = self.get_row_date(self.liststore[0])
+        for apod_list in reversed(apod_data):
+            if self.fetcher.get_apod_date(apod_list) > newest:
+                self.liststore.prepend(self.get_liststore_row(apod_list))
+        while self.loader is None and len(self.liststore) > self.days_numb:
+            self.liststore.remove(self.liststore.get_iter(self.days_numb))
+        self.on_view_changed()
+
+    def on_new_day_error(self, err):
+        """Report a failed check for a new APOD"""
+        log.warning("[ new day check failed ] %s", err)
+
+    # functions to load thumbnails for the rows in view
+    #---------------------------------------------------
+    def on_view_changed(self, *args):
+        """Schedule a thumbnail update when the visible rows change"""
+        if not self.thumbs_scheduled:
+            self.thumbs_scheduled = True
+            GLib.idle_add(self.queue_visible_thumbs)
+
+    def queue_visible_thumbs(self):
+        """Request icons near the viewport and drop the ones far from it"""
+        self.thumbs_scheduled = False
+        visible = self.treeview.get_visible_range()
+        if visible is None:
+            return False
+        margin = self.thumbnailer.margin
+        first = visible[0].get_indices()[0] - margin
+        last = visible[1].get_indices()[0] + margin
+        shown = set()
+        for row in self.filter:
+            index = row.path.get_indices()[0]
+            if first <= index <= last:
+                path = self.filter.convert_path_to_child_path(row.path)
+                shown.add(path.get_indices()[0])
+                if row[6] != self.icon_size:  # rescale without downloads
+                    self.thumbnailer.request(self.liststore, path,
+                                             row[5], self.cache_dir,
+                                             self.icon_size, row[6] != 0)
+        for row in self.liststore:
+            # release icons scrolled far out of view or filtered out
+            if row[6] and row.path.get_indices()[0] not in shown:
+                row[0] = self.placeholder
+                row[6] = 0
+        return False
+
+    # functions to search the list
+    #------------------------------
+    def filter_row(self, model, treeiter, data):
+        """Whether a liststore row matches the search"""
+        return self.search_dates is None or model[treeiter][2] in \
+            self.search_dates
+
+    def on_search_changed(self, entry):
+        """Show only the rows whose title or explanation match"""
+        text = entry.get_text().strip()
+        if text:
+            self.search_dates = set(item[0] for item in
+                                    self.fetcher.search(text))
         else:
-            os.makedirs(os.path.join(home, cache))
-            return os.path.join(home, cache)
+            self.search_dates = None
+        self.filter.refilter()
+        self.on_view_changed()
+
+    # callback for button Cancel
+    #----------------------------
+    def on_button_cancel_clicked(self, widget):
+        """Stop the load in progress"""
+        if self.loader is not None:
+            self.loader.cancel()
+        self.loader = None
+        self.progressbox.hide()
+
+    # callbacks for button Export
+    #-----------------------------
+    def on_button_export_clicked(self, widget):
+        """Copy the selected pictures, or all those shown, to a folder"""
+        model, paths = self.treeview.get_selection().get_selected_rows()
+        if not paths:
+            paths = [row.path for row in model]
+        pictures = [model[path][3] for path in paths]
+        if not pictures:
+            return
+        folder_dialog = Gtk.FileChooserDialog(
+            'Export To', self, Gtk.FileChooserAction.SELECT_FOLDER,
+            (Gtk.STOCK_CANCEL, Gtk.ResponseType.CANCEL,
+             Gtk.STOCK_OK, Gtk.ResponseType.ACCEPT))
+        folder_dialog.set_modal(True)
+        response = folder_dialog.run()
+        folder = folder_dialog.get_filename()
+        folder_dialog.destroy()
+        if response != Gtk.ResponseType.ACCEPT or folder is None:
+            return
+        if self.exporter is not None:
+            self.exporter.cancel()
+        self.exporter = ExportAPOD(self, pictures, folder)
+        self.exportbar.set_fraction(0)
+        self.exportbar.set_text('Exporting ' + str(len(pictures)) +
+                                ' pictures')
+        self.exportbox.show_all()
+        self.exporter.start()
+
+    def on_export_progress(self, done, total):
+        """Update the export bar, called from the main loop"""
+        self.exportbar.set_fraction(float(done) / total)
+        self.exportbar.set_text('Exported ' + str(done) + ' of ' + str(total))
+
+    def on_export_finished(self, error, failed, total):
+        """Hide the export bar and report failures, called from the main
+        loop"""
+        self.exporter = None
+        self.exportbox.hide()
+        if error is None:
+            return
+        log.warning("[ export incomplete ] %s", error)
+        msg1 = "%d of %d pictures were not exported." % (failed, total)
+        error_dialog = Gtk.MessageDialog(self,
+                                         0,
+                                         Gtk.MessageType.ERROR,
+                                         Gtk.ButtonsType.CLOSE,
+                                         msg1)
+        error_dialog.format_secondary_text('Last error: ' + str(error))
+        error_dialog.run()
+        error_dialog.destroy()
 
-    # function to create a liststore
-    #--------------------------------
-    def get_liststore(self, apod_data, cache_dir, icon_size):
-        """Create the liststore: icon, title, date, picture"""
-        self.liststore = Gtk.ListStore(GdkPixbuf.Pixbuf, str, str, str, str)
-        for item in apod_data:
-            dat = item[0]
-            img = item[1]
-            ico = item[2]
-            tit = item[3]
-            inf = item[4]
-            ico_name = ico.split('/')[-1]
-            tmp_name = os.path.join(cache_dir, ico_name)
-            # see if icon is already downloaded
-            if os.path.isfile(tmp_name):
-                print "[ " + GREEN + "found icon" + RESET + " ]", tmp_name
-                pass
-            else:
-                icon = urllib2.urlopen(ico).read()
-                open(tmp_name, 'wb').write(icon)
-            pxbf = GdkPixbuf.Pixbuf.new_from_file_at_scale(tmp_name,
-                                                           icon_size,
-                                                           icon_size,
-                                                           True)
-            self.liststore.append([pxbf, tit, dat, img, inf])
+    def on_button_export_cancel_clicked(self, widget):
+        """Stop the export in progress"""
+        if self.exporter is not None:
+            self.exporter.cancel()
+        self.exporter = None
+        self.exportbox.hide()
 
     # callback for button Open
     #--------------------------
     def on_button_open_clicked(self, widget, cache_dir):
         """Download and show selected picture"""
-        selection = self.treeview.get_selection()
-        model, treeiter = selection.get_selected()
+        model, treeiter = self.get_selected()
 
         if treeiter is not None:
-            tit, dat, img, inf = model[treeiter][1:]
+            tit, dat, img, inf = model[treeiter][1:5]
             img_name = img.split('/')[-1]
             tmp_name = os.path.join(cache_dir, img_name)
 
-            # see if image is already downloaded
+            # see if image is already downloaded, checking its size
             if os.path.isfile(tmp_name):
-                print "[ " + GREEN + "found image" + RESET + " ]", tmp_name
-                picture = ViewAPOD(tit, dat, img_name, tmp_name, inf)
+                log.debug("[ found image ] %s", tmp_name)
+            self.downloadbar.set_fraction(0)
+            self.downloadbar.set_text('Downloading ' + img_name)
+            self.downloadbar.show()
+            self.download = img
+            task = TaskAPOD(self.get_picture, (img, tmp_name),
+                            lambda tmp_name: self.on_picture_ready(
+                                img, tit, dat, img_name, tmp_name, inf),
+                            lambda err: self.on_picture_error(img, err, dat))
+            task.start()
+
+    def get_picture(self, img, tmp_name):
+        """Download a picture into the cache, reporting progress"""
+        def progress(done, total):
+            GLib.idle_add(self.on_picture_progress, img, done, total)
+        self.prefetcher.begin_open()  # prefetch waits for us
+        try:
+            with stats.timer('picture', url=img):
+                return self.fetcher.http.fetch_file(img, tmp_name, progress)
+        finally:
+            self.prefetcher.end_open()
+
+    def on_picture_progress(self, img, done, total):
+        """Update the download bar, called from the main loop"""
+        if img == self.download:
+            if total:
+                self.downloadbar.set_fraction(float(done) / total)
             else:
-                try:  # if not, download it
-                    pic = urllib2.urlopen(img).read()
-                    open(tmp_name, 'wb').write(pic)
-                    picture = ViewAPOD(tit, dat, img_name, tmp_name, inf)
-                except urllib2.HTTPError:  # if error, show error dialog
-                    error = self.show_error_dialog(dat)
+                self.downloadbar.pulse()
+        return False
+
+    def on_picture_ready(self, img, tit, dat, img_name, tmp_name, inf):
+        """Hide the download bar and show the picture"""
+        if img == self.download:
+            self.download = None
+            self.downloadbar.hide()
+        picture = ViewAPOD(tit, dat, img_name, tmp_name, inf, self.cache,
+                           self.preview)
+
+    def on_picture_error(self, img, err, dat):
+        """Report a failed picture download"""
+        if img == self.download:
+            self.download = None
+            self.downloadbar.hide()
+        if isinstance(err, urllib2.HTTPError):  # show error dialog
+            self.show_error_dialog(dat)
+        else:
+            log.warning("[ download failed ] %s", err)
+
+    # callback for selection changes
+    #-------------------------------
+    def get_selected(self):
+        """Model and iter of the row with the cursor, or of the first
+        selected row"""
+        selection = self.treeview.get_selection()
+        model, paths = selection.get_selected_rows()
+        path = self.treeview.get_cursor()[0]
+        if path is None or not selection.path_is_selected(path):
+            if not paths:
+                return model, None
+            path = paths[0]
+        return model, model.get_iter(path)
+
+    def on_selection_changed(self, selection):
+        """Prefetch the selected picture and its neighbours"""
+        model, treeiter = self.get_selected()
+        if not self.prefetch or treeiter is None:
+            return
+        index = model.get_path(treeiter).get_indices()[0]
+        pictures = []
+        for i in (index, index + 1, index - 1):  # selected one first
+            if 0 <= i < len(model):
+                img = model[i][3]
+                tmp_name = os.path.join(self.cache_dir, img.split('/')[-1])
+                pictures.append((img, tmp_name))
+        self.prefetcher.schedule(pictures)
 
     # callback for error dialog
     #---------------------------
@@ -271,23 +656,36 @@ class APOD(Gtk.Window):
         dialog = PrefsAPOD(self)
         response = dialog.run()
         if response == Gtk.ResponseType.OK:
-            # get new values
-            days_numb_new = dialog.spin_days.get_value_as_int()
-            icon_size_new = dialog.spin_size.get_value_as_int()
-            print "[ " + BLUE + "settings" + RESET + " ]" + \
-                  " icon size =", icon_size_new
-            print "[ " + BLUE + "settings" + RESET + " ]" + \
-                  " number of days =", days_numb_new
-            # update config file
-            apod_settings = SettingsAPOD()
-            apod_settings.write_settings(days_numb_new, icon_size_new)
-            # update liststore and reload treeview
-            cache_dir = self.get_cache_dir()  # get cache dir again
-            apod_data = self.get_apod_data(days_numb_new)  # get new data
-            self.get_liststore(apod_data, cache_dir, icon_size_new)
-            self.treeview.set_model(model=self.liststore)
+            # update config file, the changes come back to
+            # on_settings_changed
+            self.settings.set_options({
+                'days': dialog.spin_days.get_value_as_int(),
+                'size': dialog.spin_size.get_value_as_int(),
+                'jobs': dialog.spin_jobs.get_value_as_int(),
+                'cache_size': dialog.spin_cache.get_value_as_int(),
+                'prefetch': int(dialog.check_prefetch.get_active())})
         dialog.destroy()
 
+    def on_settings_changed(self, changed):
+        """Apply changed settings in place, called from the main loop"""
+        for name in sorted(changed):
+            log.info("[ settings ] %s = %s", name, changed[name])
+        if set(changed) & set(['jobs', 'timeout', 'retries', 'cache_size',
+                               'shared_cache']):
+            self.fetcher.apply_settings(self.settings)
+        if 'prefetch' in changed:
+            self.prefetch = self.settings.get_option('prefetch')
+        if 'prefetch_jobs' in changed:
+            self.prefetcher.set_workers(
+                self.settings.get_option('prefetch_jobs'))
+        # update the liststore in place, cancelling any old load
+        icon_size_new = self.settings.get_option('size')
+        if icon_size_new != self.icon_size:
+            self.rescale_thumbs(icon_size_new)
+        days_numb_new = self.settings.get_option('days')
+        if days_numb_new != self.days_numb:
+            self.resize_list(days_numb_new)
+
     # callback for button About
     #---------------------------
     def on_button_about_clicked(self, widget):
@@ -329,37 +727,2294 @@ along with this program. If not, see <http://www.gnu.org/licenses/>.
 ## C L A S S
 ###########################
 class SettingsAPOD:
-    """Manage settings file"""
+    """Manage settings file, read once and shared by the whole process"""
+
+    section = 'pyapod_settings'
+    defaults = collections.OrderedDict([  # of every setting, all in one
+        ('days', 7), ('size', 50), ('jobs', 8), ('cache_size', 500),  # MiB
+        ('prefetch', 1), ('prefetch_jobs', 2), ('timeout', 30),
+        ('retries', 3), ('shared_cache', '/var/cache/pyAPOD/cache.sock')])
+    poll_interval = 2  # seconds between checks for edits of the file
+    instance = None
+    instance_lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        """The settings of this process"""
+        with cls.instance_lock:
+            if cls.instance is None:
+                cls.instance = cls()
+            return cls.instance
 
     def __init__(self):
-        """Initialize config file"""
+        """Read the config file, use get_instance instead"""
         home = os.environ.get('HOME')
         self.conf_path = os.path.join(home, '.pyAPOD.cfg')
-        self.conf_file = ConfigParser.SafeConfigParser()
-        self.conf_file.read(self.conf_path)
+        self.lock = threading.RLock()
+        self.subscribers = []
+        self.stamp = None  # version of the file read or written last
+        self.conf_file = self.read()
+
+    def read(self):
+        """Parse the config file, remembering its version"""
+        conf_file = ConfigParser.SafeConfigParser()
+        self.stamp = self.get_stamp()
+        try:
+            conf_file.read(self.conf_path)
+        except ConfigParser.Error as err:  # keep going with the defaults
+            log.warning("[ bad settings ] %s", err)
+        if not conf_file.has_section(self.section):
+            conf_file.add_section(self.section)
+        return conf_file
+
+    def get_stamp(self):
+        """Modification time, size and inode of the config file"""
+        try:
+            stat = os.stat(self.conf_path)
+        except OSError:
+            return None
+        return stat.st_mtime, stat.st_size, stat.st_ino
 
     def get_settings(self):
         """Read or create the config file"""
-        if os.path.isfile(self.conf_path):
-            # read config file
-            days_numb = self.conf_file.get('pyapod_settings', 'days')
-            icon_size = self.conf_file.get('pyapod_settings', 'size')
+        if not os.path.isfile(self.conf_path):
+            self.set_options(self.defaults)
+        return self.get_option('days'), self.get_option('size')
+
+    def get_option(self, name):
+        """Read an integer setting, its default if unset or invalid"""
+        default = self.defaults[name]
+        with self.lock:
+            try:
+                return self.conf_file.getint(self.section, name)
+            except ConfigParser.NoOptionError:
+                return default
+            except ValueError as err:
+                log.warning("[ bad settings ] %s", err)
+                return default
+
+    def get_text(self, name):
+        """Read a text setting, its default if unset"""
+        default = self.defaults[name]
+        with self.lock:
+            try:
+                return self.conf_file.get(self.section, name, raw=True)
+            except ConfigParser.NoOptionError:
+                return default
+
+    def get_values(self):
+        """Raw text of every setting"""
+        return dict(self.conf_file.items(self.section, raw=True))
+
+    def set_options(self, values):
+        """Change settings, write them and tell the subscribers"""
+        with self.lock:
+            old = self.get_values()
+            self.conf_file = self.read()  # keep edits made meanwhile
+            for name, value in values.items():
+                self.conf_file.set(self.section, name, str(value))
+            self.write()
+            changed = self.get_changes(old)
+        self.notify(changed)
+
+    def write(self):
+        """Replace the config file in one step, so readers never see a
+        partial file"""
+        fd, part_name = tempfile.mkstemp(prefix='.pyAPOD.cfg.',
+                                         dir=os.path.dirname(self.conf_path))
+        try:
+            with os.fdopen(fd, 'w') as part:
+                self.conf_file.write(part)
+                part.flush()
+                os.fsync(part.fileno())
+            os.rename(part_name, self.conf_path)
+        except (IOError, OSError) as err:
+            log.warning("[ settings not saved ] %s", err)
+            if os.path.isfile(part_name):
+                os.remove(part_name)
+        self.stamp = self.get_stamp()
+
+    def get_changes(self, old):
+        """New text of the settings that differ from old ones"""
+        new = self.get_values()
+        return dict((name, new.get(name))
+                    for name in set(old) | set(new)
+                    if old.get(name) != new.get(name))
+
+    def subscribe(self, callback):
+        """Call back with a dict of the new values on every change"""
+        self.subscribers.append(callback)
+
+    def notify(self, changed):
+        """Tell the subscribers about changed settings"""
+        if changed:
+            for callback in list(self.subscribers):
+                callback(changed)
+
+    def watch(self):
+        """Pick up edits of the file by other programs, from the main loop"""
+        GLib.timeout_add_seconds(self.poll_interval, self.check_file)
+
+    def check_file(self):
+        """Reload the file if it changed since it was read or written"""
+        if self.get_stamp() != self.stamp:
+            with self.lock:
+                old = self.get_values()
+                self.conf_file = self.read()
+                changed = self.get_changes(old)
+            self.notify(changed)
+        return True  # keep watching
+
+
+#############
+## C L A S S
+###########################
+class FetchAPOD:
+    """Fetch, parse and cache APOD data, without a user interface"""
+
+    base_url = "http://apod.nasa.gov/apod/"
+    first_date = datetime.date(1995, 6, 16)  # first APOD
+    archive_line = re.compile(r'href="ap(\d{6})\.html">([^<]*)</a>')
+    missing_codes = (404, 410)  # answers meaning there is no APOD that day
+
+    def __init__(self, apod_settings):
+        """Open the cache and the HTTP client"""
+        self.cache_dir = self.get_cache_dir()
+        self.meta_cache = MetaCacheAPOD(self.cache_dir)
+        self.cache = CacheAPOD(self.meta_cache, self.cache_dir,
+                               float('inf'))  # budget set below
+        self.http = HttpAPOD(self.meta_cache, self.cache)
+        self.pool = None  # page fetchers, kept from one load to the next
+        self.pool_size = 0
+        self.pool_lock = threading.Lock()
+        self.apply_settings(apod_settings)
+
+    def apply_settings(self, apod_settings):
+        """Take the downloads, timeout, retries, shared cache and cache size
+        settings"""
+        self.jobs = apod_settings.get_option('jobs')
+        self.http.timeout = apod_settings.get_option('timeout')
+        self.http.retries = apod_settings.get_option('retries')
+        shared_socket = apod_settings.get_text('shared_cache')
+        if shared_socket:  # an empty setting turns the shared cache off
+            self.http.shared = SharedCacheAPOD(shared_socket)
+        else:
+            self.http.shared = None
+        cache_size = apod_settings.get_option('cache_size')  # MiB
+        self.cache.budget = cache_size * 1024 * 1024
+        # a smaller budget may take long to reach, not before the first paint
+        evicter = threading.Thread(target=self.cache.evict)
+        evicter.start()
+
+    # functions to fetch APOD data
+    #------------------------------
+    def iter_apod_data(self, num, jobs=1, cancel=None, start=None):
+        """Yield APOD data for a number of dates, newest first"""
+        date = start or datetime.date.today()
+        found = 0
+        try:
+            self.update_date_index()
+        except (urllib2.URLError, IOError) as err:  # probe days instead
+            log.warning("[ no date index ] %s", err)
+        pool = self.get_pool(jobs)
+        while found < num and date >= self.first_date:
+            # fetch a window of candidate dates in parallel, the results
+            # come back in date order and missing days are skipped
+            dates = self.plan_dates(date, num - found)
+            if not dates:
+                break
+            for apod_list in pool.imap(self.try_apod_entry, dates):
+                if cancel is not None and cancel.is_set():
+                    return
+                if apod_list is not False:
+                    found = found + 1
+                    yield apod_list
+            date = dates[-1] - datetime.timedelta(days=1)  # next window
+
+    def get_pool(self, jobs):
+        """Worker threads for page fetches, kept between loads so that their
+        keep-alive connections are reused"""
+        jobs = max(1, jobs)
+        with self.pool_lock:
+            if self.pool is None or self.pool_size != jobs:
+                if self.pool is not None:
+                    self.pool.close()  # its workers end after their jobs
+                self.pool = ThreadPool(jobs)
+                self.pool_size = jobs
+            return self.pool
+
+    def get_apod_newer(self, date, num, jobs=1):
+        """APOD data for up to num dates after a date, newest first"""
+        apod_data = []
+        items = self.iter_apod_data(num, jobs)
+        try:
+            for apod_list in items:
+                if self.get_apod_date(apod_list) <= date:
+                    break
+                apod_data.append(apod_list)
+        finally:
+            items.close()
+        return apod_data
+
+    def get_apod_date(self, apod_list):
+        """Date of APOD data, from its formatted date"""
+        return datetime.datetime.strptime(apod_list[0], '%Y %b %d').date()
+
+    def plan_dates(self, date, size):
+        """Up to size dates with an APOD, from date backwards"""
+        newest = self.meta_cache.get_newest_date()
+        if newest is None:  # no index, try every day
+            days = size
+        elif date > newest:  # not indexed yet, try the days after newest
+            days = min(size, (date - newest).days)
+        else:
+            return self.meta_cache.get_dates(date, size)
+        return [date - datetime.timedelta(days=i) for i in range(days)]
+
+    # functions to index the dates with an APOD
+    #-------------------------------------------
+    def update_date_index(self):
+        """Add the dates listed on the archive page since the last update"""
+        today = datetime.date.today()
+        newest = self.meta_cache.get_newest_date()
+        if newest is not None and newest >= today:
+            return
+        url = self.base_url + 'archivepix.html'
+        checked = self.meta_cache.get_validators(url)[3]
+        if checked is not None and time.time() - checked < self.meta_cache.ttl:
+            return  # checked a moment ago
+        resp = self.http.open(url)
+        dates = []
+        try:
+            tail = ''
+            done = False
+            while not done:  # the newest dates come first
+                chunk = resp.read(self.http.chunk_size)
+                if chunk:
+                    lines = (tail + chunk).split('\n')
+                    tail = lines.pop()
+                else:
+                    lines = [tail]
+                    done = True
+                for line in lines:
+                    match = self.archive_line.search(line)
+                    if match is None:
+                        continue
+                    date = self.get_archive_date(match.group(1))
+                    if newest is not None and date <= newest:
+                        done = True  # the rest is indexed already
+                        break
+                    dates.append((date, match.group(2).strip()))
+        finally:
+            resp.close()
+        self.meta_cache.put_dates(dates)
+        self.meta_cache.put_validators(url, None, None, None)
+
+    def get_archive_date(self, yymmdd):
+        """Date of an apYYMMDD.html page"""
+        year = int(yymmdd[:2])
+        if year >= self.first_date.year % 100:
+            year = year + 1900
+        else:
+            year = year + 2000
+        return datetime.date(year, int(yymmdd[2:4]), int(yymmdd[4:]))
+
+    def get_dates_between(self, date_from, date_to):
+        """Dates with an APOD in a range, newest first, from the index"""
+        self.update_date_index()
+        return self.meta_cache.get_dates_between(date_from, date_to)
+
+    def get_apod_entry(self, date):
+        """APOD data for a given date, from the metadata cache if known"""
+        apod_list = self.meta_cache.get(date)
+        if apod_list is None:
+            stats.count('page misses')
+            apod_list = self.get_apod_list(date)  # not seen yet, fetch it
+            self.meta_cache.put(date, apod_list)
+        else:
+            stats.count('page hits')
+        return apod_list
+
+    def try_apod_entry(self, date):
+        """APOD data for a given date, False if the server fails on it"""
+        try:
+            return self.get_apod_entry(date)
+        except urllib2.HTTPError as err:  # skipped this time only
+            log.warning("[ page failed ] %s %s", date, err)
+            return False
+
+    def get_apod_list(self, date):
+        """Fetch APOD data for a given date"""
+        icon = "calendar/S_" + date.strftime('%y%m%d') + ".jpg"
+        page = "ap" + date.strftime('%y%m%d') + ".html"
+        base_url = self.base_url
+        apod_url = base_url + page
+
+        # fetch and parse the web page
+        try:
+            apod_htm = self.http.open(apod_url)
+        except urllib2.HTTPError as err:
+            if err.code not in self.missing_codes:
+                raise  # the server failed, not cached so it is tried again
+            return False
+        try:
+            with stats.timer('parse', url=apod_url):  # reads as it parses
+                apod_tit, apod_pic, apod_inf = PageParserAPOD().parse(
+                    apod_htm)
+        except PageErrorAPOD as err:  # e.g. a video instead of a picture
+            log.info("[ skipped page ] %s %s", apod_url, err)
+            return False
+        finally:
+            apod_htm.close()
+
+        # extract title and picture
+        apod_img = base_url + apod_pic
+        apod_ico = base_url + icon
+
+        # fromat date
+        apod_dat = date.strftime('%Y %h %d')
+
+        return [apod_dat, apod_img, apod_ico, apod_tit, apod_inf]
+
+    # function to search the cached pages
+    #-------------------------------------
+    def search(self, query, limit=-1):
+        """Cached APOD data matching a query, newest first"""
+        return self.meta_cache.search(query, limit)
+
+    # function to get cache directory
+    #---------------------------------
+    def get_cache_dir(self):
+        """Create cache directory if it doesn't exist"""
+        home = os.environ.get('HOME')
+        cache = os.path.join('.cache', 'pyAPOD')
+        if os.path.isdir(os.path.join(home, cache)):
+            return os.path.join(home, cache)
+        else:
+            os.makedirs(os.path.join(home, cache))
+            return os.path.join(home, cache)
+
+    # functions to scale icons
+    #--------------------------
+    def get_thumbnail(self, ico, cache_dir, icon_size, offline=False):
+        """Download and decode the icon of a day, scaled"""
+        ico_name = ico.split('/')[-1]
+        tmp_name = os.path.join(cache_dir, ico_name)
+        # see if icon is already downloaded
+        if os.path.isfile(tmp_name):
+            log.debug("[ found icon ] %s", tmp_name)
+        if not (offline and os.path.isfile(tmp_name)):
+            with stats.timer('icon', url=ico):  # download or check it
+                tmp_name = self.http.fetch_file(ico, tmp_name)
+        # see if a scaled copy newer than the icon exists
+        thumb_name = self.get_thumb_name(ico, cache_dir, icon_size)
+        thumb_dir = os.path.dirname(thumb_name)
+        if (os.path.isfile(thumb_name) and
+                os.path.getmtime(thumb_name) >= os.path.getmtime(tmp_name)):
+            self.cache.hit(thumb_name)
+            with stats.timer('decode', path=thumb_name):
+                return GdkPixbuf.Pixbuf.new_from_file(thumb_name)
+        with stats.timer('decode', path=tmp_name):
+            pxbf = GdkPixbuf.Pixbuf.new_from_file_at_scale(tmp_name,
+                                                           icon_size,
+                                                           icon_size,
+                                                           True)
+        # store the scaled copy, renamed into place once complete
+        fd, part_name = tempfile.mkstemp(suffix='.png', dir=thumb_dir)
+        os.close(fd)
+        try:
+            pxbf.savev(part_name, 'png', [], [])
+            os.rename(part_name, thumb_name)
+        except (GLib.GError, OSError) as err:  # still show the icon
+            log.warning("[ thumbnail not saved ] %s %s", thumb_name, err)
+            if os.path.isfile(part_name):
+                os.remove(part_name)
+        else:
+            self.cache.add(thumb_name)
+        return pxbf
+
+    def get_thumb_name(self, ico, cache_dir, icon_size):
+        """File of an icon scaled to a size"""
+        ico_name = os.path.splitext(ico.split('/')[-1])[0]
+        return os.path.join(self.get_thumb_dir(cache_dir, icon_size),
+                            ico_name + '.png')
+
+    def get_thumb_dir(self, cache_dir, icon_size):
+        """Create the directory of icons scaled to a size"""
+        thumb_dir = os.path.join(cache_dir, 'thumbs', str(icon_size))
+        try:
+            os.makedirs(thumb_dir)
+        except OSError:  # already there
+            pass
+        return thumb_dir
+
+    # functions to save and restore the list between runs
+    #------------------------------------------------------
+    def get_snapshot_name(self):
+        """File keeping the list shown at exit"""
+        return os.path.join(self.cache_dir, 'snapshot.json')
+
+    def save_snapshot(self, apod_data, icon_size):
+        """Store APOD data, with the icons scaled to a size, for next
+        launch"""
+        rows = []
+        for dat, img, ico, tit, inf in apod_data:
+            thumb = self.get_thumb_name(ico, self.cache_dir, icon_size)
+            if os.path.isfile(thumb):
+                thumb = os.path.relpath(thumb, self.cache_dir)
+            else:
+                thumb = None
+            rows.append({'tit': tit, 'dat': dat, 'img': img,
+                         'inf': inf, 'ico': ico, 'thumb': thumb})
+        snapshot = {'version': 1, 'icon_size': icon_size, 'rows': rows}
+        fd, part_name = tempfile.mkstemp(suffix='.json', dir=self.cache_dir)
+        try:
+            with os.fdopen(fd, 'w') as part:
+                json.dump(snapshot, part)
+            os.rename(part_name, self.get_snapshot_name())
+        except (IOError, OSError, UnicodeError) as err:
+            log.warning("[ snapshot failed ] %s", err)
+            os.remove(part_name)
+
+    def load_snapshot(self, num, icon_size, decoded):
+        """APOD data of the last snapshot, up to a number of days, each with
+        its icon if among the first decoded rows, else None"""
+        try:
+            with open(self.get_snapshot_name()) as snap:
+                snapshot = json.load(snap)
+        except (IOError, ValueError):
+            return []
+        if snapshot.get('version') != 1:
+            return []
+        same_size = snapshot['icon_size'] == icon_size
+        rows = []
+        for index, item in enumerate(snapshot['rows'][:num]):
+            pxbf = None
+            if same_size and item['thumb'] and index < decoded:
+                try:
+                    pxbf = GdkPixbuf.Pixbuf.new_from_file(
+                        os.path.join(self.cache_dir, item['thumb']))
+                except GLib.GError:  # evicted, loaded as usual
+                    pass
+            rows.append(([(item[key] or u'').encode('utf-8')
+                          for key in ('dat', 'img', 'ico', 'tit', 'inf')],
+                         pxbf))
+        return rows
+
+    # functions to mirror the archive
+    #----------------------------------
+    def mirror(self, date_from, date_to, jobs):
+        """Download pages, icons and pictures for a range of dates"""
+        self.cache.budget = float('inf')  # keep everything, but index it
+        try:
+            indexed = set(self.get_dates_between(date_from, date_to))
+        except (urllib2.URLError, IOError) as err:  # probe every day
+            log.warning("[ no date index ] %s", err)
+            indexed = set()
+        newest = self.meta_cache.get_newest_date()
+        dates = []
+        date = date_to
+        while date >= date_from:
+            if newest is not None and date <= newest and date not in indexed:
+                pass  # no APOD that day
+            elif not self.meta_cache.is_mirrored(date):
+                dates.append(date)
+            date = date - datetime.timedelta(days=1)
+        log.info("[ mirror ] %s dates to mirror from "
+                 "%s to %s", len(dates), date_from, date_to)
+        failed = 0
+        pool = ThreadPool(max(1, jobs))
+        try:
+            for date, error in pool.imap_unordered(self.mirror_date, dates):
+                if error is None:
+                    log.info("[ mirrored ] %s", date)
+                else:
+                    log.warning("[ failed ] %s %s", date, error)
+                    failed = failed + 1
+        finally:
+            pool.terminate()
+        return failed
+
+    def mirror_date(self, date):
+        """Mirror one date, then record it in the checkpoint"""
+        try:
+            apod_list = self.meta_cache.get(date)
+            if not apod_list:  # unknown, or known missing: make sure of it
+                apod_list = self.get_apod_list(date)  # before the checkpoint
+                self.meta_cache.put(date, apod_list)
+            if apod_list is not False:
+                for url in (apod_list[2], apod_list[1]):  # icon, picture
+                    name = url.split('/')[-1]
+                    self.http.fetch_file(url, os.path.join(self.cache_dir,
+                                                           name))
+        except (urllib2.URLError, IOError) as err:
+            return date, err  # not checkpointed, retried next run
+        if date < datetime.date.today():  # today's page may still change
+            self.meta_cache.put_mirrored(date)
+        return date, None
+
+
+#############
+## C L A S S
+###########################
+class HttpAPOD:
+    """Shared HTTP client with keep-alive connections and revalidation"""
+
+    max_age = 7 * 24 * 3600  # seconds before a cached file is revalidated
+    redirects = 5
+    chunk_size = 65536
+    retry_codes = (500, 502, 503, 504)
+    lock_slots = 64  # lock files shared by the processes of a user
+
+    def __init__(self, meta_cache, cache, timeout=30, retries=3,
+                 backoff=0.5):
+        """Initialize the client"""
+        self.meta_cache = meta_cache  # keeps ETag and Last-Modified
+        self.cache = cache  # keeps the cache directory under budget
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.local = threading.local()  # connections of each thread
+        self.locks = [threading.Lock() for i in range(self.lock_slots)]
+        self.shared = None  # client of the shared cache service, if any
+
+    def connection(self, scheme, host):
+        """Keep-alive connection to a host for the current thread"""
+        conns = self.local.__dict__.setdefault('conns', {})
+        conn = conns.get((scheme, host))
+        if conn is not None and conn.timeout != self.timeout:
+            conn.close()  # made before the timeout setting changed
+            del conns[(scheme, host)]
+        if (scheme, host) not in conns:
+            if scheme == 'https':
+                conn = httplib.HTTPSConnection(host, timeout=self.timeout)
+            else:
+                conn = httplib.HTTPConnection(host, timeout=self.timeout)
+            conns[(scheme, host)] = conn
+        return conns[(scheme, host)]
+
+    def request(self, url, headers=None, method='GET'):
+        """Send a request following redirects, retrying with backoff"""
+        headers = dict(headers or {})
+        headers['User-Agent'] = 'pyAPOD/' + __version__
+        for redirect in range(self.redirects + 1):
+            parts = urlparse.urlsplit(url)
+            path = parts.path or '/'
+            if parts.query:
+                path = path + '?' + parts.query
+            conn = self.connection(parts.scheme, parts.netloc)
+            attempt = 0
+            while True:
+                stats.count('requests')
+                reused = conn.sock is not None  # the server may have closed it
+                try:
+                    with stats.timer('fetch', url=url, method=method):
+                        conn.request(method, path, headers=headers)
+                        resp = ResponseAPOD(conn, conn.getresponse())
+                except (httplib.HTTPException, socket.error) as err:
+                    conn.close()  # reconnects on the next request
+                    if reused:  # an idle keep-alive connection, not a retry
+                        stats.count('reconnects')
+                        continue
+                    if attempt >= self.retries:
+                        raise urllib2.URLError(err)
+                else:
+                    if (resp.status not in self.retry_codes or
+                            attempt >= self.retries):
+                        break
+                    resp.close()
+                stats.count('retries')
+                time.sleep(self.backoff * 2 ** attempt)
+                attempt = attempt + 1
+            location = resp.getheader('location')
+            if resp.status in (301, 302, 303, 307, 308) and location:
+                resp.close()
+                url = urlparse.urljoin(url, location)
+                continue
+            if resp.status >= 400:
+                resp.close()
+                raise urllib2.HTTPError(url, resp.status, resp.reason,
+                                        resp.msg, None)
+            return resp
+        raise urllib2.URLError('too many redirects: ' + url)
+
+    def open(self, url):
+        """Response for a url, the caller must close it"""
+        return self.request(url)
+
+    def fetch_file(self, url, path, progress=None):
+        """Download a url to a file unless the cached copy is valid; return
+        the file to read, which is in the shared cache if there is one"""
+        if self.shared is not None:
+            shared_path = self.shared.fetch(url, progress)
+            if shared_path is not None:
+                return shared_path
+        with self.file_lock(path):  # one download per file at a time
+            with self.process_lock(path):  # also in other instances
+                return self.fetch_locked(url, path, progress)
+
+    def file_lock(self, path):
+        """Lock serializing the downloads of a file, one of a few slots so
+        that a long-running service does not keep a lock per file"""
+        return self.locks[self.get_slot(path)]
+
+    def get_slot(self, path):
+        """Lock slot of a file, the same in every process"""
+        return int(hashlib.sha1(path).hexdigest()[:8], 16) % self.lock_slots
+
+    @contextlib.contextmanager
+    def process_lock(self, path):
+        """Lock serializing the downloads of a file across processes"""
+        lock_dir = os.path.join(self.cache.cache_dir, '.locks')
+        if not os.path.isdir(lock_dir):
+            try:
+                os.makedirs(lock_dir)
+            except OSError:  # made by another process
+                pass
+        slot = self.get_slot(path)
+        with open(os.path.join(lock_dir, str(slot)), 'a') as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            yield  # closing the file releases the lock
+
+    def fetch_locked(self, url, path, progress):
+        """Stream a url to a file, resuming a partial download"""
+        etag, modified, length, checked = self.meta_cache.get_validators(url)
+        headers = {}
+        if os.path.isfile(path):
+            size = os.path.getsize(path)
+            if length is None:  # size never checked, it may be truncated
+                length = self.get_length(url)
+                if length is None or size == length:
+                    self.meta_cache.put_validators(url, etag, modified, size)
+                    self.cache.hit(path)
+                    return path
+            elif size == length:
+                if time.time() - checked < self.max_age:
+                    self.cache.hit(path)
+                    return path
+                if etag:
+                    headers['If-None-Match'] = etag
+                if not modified:
+                    modified = formatdate(os.path.getmtime(path), usegmt=True)
+                headers['If-Modified-Since'] = modified
+
+        # resume a partial download if there is one
+        part_name = path + '.part'
+        offset = 0
+        if not headers and os.path.isfile(part_name):
+            offset = os.path.getsize(part_name)
+        if offset:
+            headers['Range'] = 'bytes=' + str(offset) + '-'
+            if etag:
+                headers['If-Range'] = etag  # whole file if it changed
+        try:
+            resp = self.request(url, headers)
+        except urllib2.HTTPError as err:
+            if err.code != 416 or not offset:
+                raise
+            os.remove(part_name)  # bad partial file, start again
+            return self.fetch_locked(url, path, progress)
+
+        try:
+            if resp.status == 304:  # still valid, a cache hit
+                stats.count('not modified')
+                etag = resp.getheader('etag') or headers.get('If-None-Match')
+                self.meta_cache.put_validators(url, etag,
+                                               headers['If-Modified-Since'],
+                                               length)
+                self.cache.hit(path)
+                return path
+            if resp.status == 206:
+                mode = 'ab'
+            else:
+                mode = 'wb'
+                offset = 0
+            total = resp.getheader('content-length')
+            if total is not None:
+                total = offset + int(total)
+            done = offset
+            with open(part_name, mode) as part:
+                while True:
+                    chunk = resp.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    part.write(chunk)
+                    done = done + len(chunk)
+                    if progress is not None:
+                        progress(done, total)
+        finally:
+            resp.close()
+        if total is not None and done != total:  # keep the part to resume
+            raise urllib2.URLError('incomplete download: ' + url)
+        os.rename(part_name, path)
+        self.meta_cache.put_validators(url, resp.getheader('etag'),
+                                       resp.getheader('last-modified'), done)
+        self.cache.add(path)
+        return path
+
+    def get_length(self, url):
+        """Content-Length of a url from a HEAD request, or None"""
+        try:
+            resp = self.request(url, method='HEAD')
+        except urllib2.HTTPError:
+            return None
+        resp.close()
+        length = resp.getheader('content-length')
+        if length is None:
+            return None
+        return int(length)
+
+
+#############
+## C L A S S
+###########################
+class ResponseAPOD:
+    """HTTP response that leaves its connection ready for reuse"""
+
+    drain_size = 65536  # read up to this much to keep the connection
+
+    def __init__(self, conn, resp):
+        """Wrap a httplib response"""
+        self.conn = conn
+        self.resp = resp
+        self.status = resp.status
+        self.reason = resp.reason
+        self.msg = resp.msg
+
+    def getheader(self, name, default=None):
+        """Value of a response header"""
+        return self.resp.getheader(name, default)
+
+    def read(self, size=None):
+        """Read the body, or up to size bytes of it"""
+        if size is None:
+            data = self.resp.read()
+        else:
+            data = self.resp.read(size)
+        stats.count('bytes', len(data))
+        return data
+
+    def close(self):
+        """Finish the response, dropping the connection if needed"""
+        if not self.resp.isclosed():
+            length = self.resp.length
+            if length is not None and length <= self.drain_size:
+                self.read()
+            else:
+                self.conn.close()
+        self.resp.close()
+
+
+#############
+## C L A S S
+###########################
+class PageErrorAPOD(Exception):
+    """APOD page without the expected layout"""
+    pass
+
+
+#############
+## C L A S S
+###########################
+class PageParserAPOD(HTMLParser.HTMLParser):
+    """Extract title, picture and explanation from an APOD page"""
+
+    chunk_size = 4096
+    void_tags = ('br', 'img', 'hr', 'input', 'meta', 'link')
+    img_exts = ('.jpg', '.jpeg', '.png', '.gif')
+
+    def __init__(self):
+        """Initialize the parser"""
+        HTMLParser.HTMLParser.__init__(self)
+        self.count_a = 0  # tags seen so far
+        self.count_b = 0
+        self.count_p = 0
+        self.title = None  # text of the first <b>
+        self.picture = None  # href of the second <a>
+        self.info = None  # markup of the third <p>
+        self.in_title = False
+        self.inner = []  # tags open inside the third <p>
+        self.done = False
+
+    def parse(self, stream):
+        """Read the page in chunks until everything is found"""
+        try:
+            while not self.done:
+                chunk = stream.read(self.chunk_size)
+                if not chunk:
+                    break
+                self.feed(chunk)
+            if not self.done:
+                self.close()
+                self.end_info()
+        except HTMLParser.HTMLParseError as err:
+            raise PageErrorAPOD('malformed page: ' + str(err))
+        if self.title is None:
+            raise PageErrorAPOD('no title found')
+        if self.picture is None:
+            raise PageErrorAPOD('no picture link found')
+        if not self.picture.lower().endswith(self.img_exts):
+            raise PageErrorAPOD('no picture, the link is ' + self.picture)
+        if self.info is None:
+            raise PageErrorAPOD('no explanation found')
+        return self.title.strip(), self.picture, ''.join(self.info)
+
+    def handle_starttag(self, tag, attrs):
+        """Count tags and copy the ones inside the explanation"""
+        if self.done:
+            return
+        if tag == 'p':
+            self.end_info()
+            self.count_p = self.count_p + 1
+            if self.count_p == 3:
+                self.info = ['<p>']
+            return
+        if tag == 'a':
+            self.count_a = self.count_a + 1
+            if self.count_a == 2:
+                self.picture = dict(attrs).get('href')
+        elif tag == 'b':
+            self.count_b = self.count_b + 1
+            if self.count_b == 1:
+                self.title = ''
+                self.in_title = True
+        if self.info is not None:
+            text = ''.join(' %s="%s"' % (name, cgi.escape(value or '', True))
+                           for name, value in attrs)
+            if tag in self.void_tags:
+                self.info.append('<%s%s />' % (tag, text))
+            else:
+                self.info.append('<%s%s>' % (tag, text))
+                self.inner.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        """Treat <tag/> as a start tag"""
+        self.handle_starttag(tag, attrs)
+
+    def handle_endtag(self, tag):
+        """Close the title or the explanation"""
+        if self.done:
+            return
+        if tag == 'b':
+            self.in_title = False
+        if self.info is None:
+            return
+        if tag in self.inner:
+            while self.inner:
+                name = self.inner.pop()
+                self.info.append('</%s>' % name)
+                if name == tag:
+                    break
+        elif tag not in self.void_tags:  # </p> or a parent closes the <p>
+            self.end_info()
+
+    def handle_data(self, data):
+        """Collect title text and explanation text"""
+        if self.done:
+            return
+        if self.in_title:
+            self.add_title(data)
+        if self.info is not None:
+            self.info.append(data)
+
+    def handle_entityref(self, name):
+        """Keep entities in the explanation, decode them in the title"""
+        if self.done:
+            return
+        if self.in_title:
+            self.add_title(self.unescape('&%s;' % name))
+        if self.info is not None:
+            self.info.append('&%s;' % name)
+
+    def handle_charref(self, name):
+        """Keep character references like entities"""
+        if self.done:
+            return
+        if self.in_title:
+            self.add_title(self.unescape('&#%s;' % name))
+        if self.info is not None:
+            self.info.append('&#%s;' % name)
+
+    def add_title(self, text):
+        """Append text to the title, as UTF-8 like the rest of the page"""
+        if isinstance(text, unicode):
+            text = text.encode('utf-8')
+        self.title = self.title + text
+
+    def end_info(self):
+        """Finish the explanation markup, then stop parsing"""
+        if self.info is not None and not self.done:
+            while self.inner:
+                self.info.append('</%s>' % self.inner.pop())
+            self.info.append('</p>')
+            self.done = True
+
+
+#############
+## C L A S S
+###########################
+class TaskAPOD(threading.Thread):
+    """Run a function in the background and hand its result to Gtk"""
+
+    def __init__(self, func, args, done, error=None):
+        """Initialize the task"""
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.func = func
+        self.args = args
+        self.done = done
+        self.error = error
+
+    def run(self):
+        """Call the function, then the callbacks from the main loop"""
+        try:
+            result = self.func(*self.args)
+        except Exception as err:
+            if self.error is None:
+                raise
+            GLib.idle_add(self.finish, self.error, err)
+        else:
+            GLib.idle_add(self.finish, self.done, result)
+
+    def finish(self, callback, value):
+        """Run a callback once in the main loop"""
+        callback(value)
+        return False
+
+
+#############
+## C L A S S
+###########################
+class LoaderAPOD(threading.Thread):
+    """Fill a liststore with APOD rows in the background"""
+
+    def __init__(self, apod, liststore, num, start=None):
+        """Initialize the loader"""
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.apod = apod
+        self.liststore = liststore
+        self.num = num  # rows to append
+        self.start_date = start  # newest date to look at, None for today
+        self.loaded = 0
+        self.cancelled = threading.Event()
+
+    def cancel(self):
+        """Stop loading, no more rows reach the liststore"""
+        self.cancelled.set()
+
+    def run(self):
+        """Fetch rows, appending them from the main loop"""
+        error = None
+        try:
+            fetcher = self.apod.fetcher
+            for item in fetcher.iter_apod_data(self.num, fetcher.jobs,
+                                               self.cancelled,
+                                               self.start_date):
+                if self.cancelled.is_set():
+                    return
+                GLib.idle_add(self.append_row, item)
+        except (urllib2.URLError, IOError, sqlite3.Error) as err:
+            error = err  # e.g. the database locked by another instance
+        finally:
+            GLib.idle_add(self.finish, error)  # whatever went wrong
+
+    def append_row(self, item):
+        """Append a row to the liststore, called from the main loop"""
+        if not self.cancelled.is_set():
+            with stats.timer('append'):
+                self.liststore.append(self.apod.get_liststore_row(item))
+            self.loaded = self.loaded + 1
+            self.apod.on_load_progress(self.loaded, self.num)
+            self.apod.on_view_changed()
+        return False
+
+    def finish(self, error):
+        """Report the end of the load, called from the main loop"""
+        if not self.cancelled.is_set():
+            self.apod.on_load_finished(error)
+        return False
+
+
+#############
+## C L A S S
+###########################
+class ExportAPOD(threading.Thread):
+    """Copy pictures to a folder in the background"""
+
+    def __init__(self, apod, pictures, folder):
+        """Initialize the export"""
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.apod = apod
+        self.pictures = pictures  # urls of the pictures to copy
+        self.folder = folder
+        self.exported = 0
+        self.failed = 0
+        self.cancelled = threading.Event()
+
+    @staticmethod
+    def copy_file(src, dst):
+        """Copy a file without reading it into memory: a hard link when it
+        is ours and on the same file system, else a streamed copy"""
+        part_name = dst + '.part'
+        if os.path.lexists(part_name):
+            os.remove(part_name)
+        try:
+            try:
+                if os.stat(src).st_uid != os.getuid():
+                    raise OSError('not ours')  # e.g. in the shared cache
+                os.link(src, part_name)
+            except OSError:  # another file system, or no links there
+                shutil.copyfile(src, part_name)
+            os.rename(part_name, dst)
+        except (IOError, OSError):
+            if os.path.lexists(part_name):
+                os.remove(part_name)
+            raise
+
+    def cancel(self):
+        """Stop after the picture being copied"""
+        self.cancelled.set()
+
+    def run(self):
+        """Download the pictures not cached yet and copy each one"""
+        fetcher = self.apod.fetcher
+        error = None
+        for img in self.pictures:
+            if self.cancelled.is_set():
+                return
+            img_name = img.split('/')[-1]
+            cache_name = os.path.join(fetcher.cache_dir, img_name)
+            dst = os.path.join(self.folder, img_name)
+            fetcher.cache.pin(cache_name)
+            try:
+                tmp_name = fetcher.http.fetch_file(img, cache_name)
+                # a picture exported before is left alone
+                if not (os.path.isfile(dst) and os.path.getsize(dst) ==
+                        os.path.getsize(tmp_name)):
+                    self.copy_file(tmp_name, dst)
+            except (urllib2.URLError, IOError, OSError) as err:
+                log.warning("[ export failed ] %s %s", img, err)
+                error = err
+                self.failed = self.failed + 1
+            finally:
+                fetcher.cache.unpin(cache_name)
+            GLib.idle_add(self.progress)
+        GLib.idle_add(self.finish, error)
+
+    def progress(self):
+        """Count a copied picture, called from the main loop"""
+        if not self.cancelled.is_set():
+            self.exported = self.exported + 1
+            self.apod.on_export_progress(self.exported, len(self.pictures))
+        return False
+
+    def finish(self, error):
+        """Report the end of the export, called from the main loop"""
+        if not self.cancelled.is_set():
+            self.apod.on_export_finished(error, self.failed,
+                                         len(self.pictures))
+        return False
+
+
+#############
+## C L A S S
+###########################
+class ThumbnailerAPOD:
+    """Fetch and decode liststore icons in the background"""
+
+    margin = 10  # rows to prefetch above and below the viewport
+
+    def __init__(self, apod, workers):
+        """Start the worker threads"""
+        self.apod = apod
+        self.pending = set()  # only used from the main loop
+        self.queue = Queue.LifoQueue()  # latest requests are in view
+        for i in range(max(1, workers)):
+            worker = threading.Thread(target=self.work)
+            worker.daemon = True
+            worker.start()
+
+    def request(self, liststore, path, ico, cache_dir, icon_size,
+                offline=False):
+        """Queue the icon of a row, called from the main loop"""
+        if (ico, icon_size) in self.pending:
+            return
+        self.pending.add((ico, icon_size))
+        ref = Gtk.TreeRowReference.new(liststore, path)
+        self.queue.put((liststore, ref, ico, cache_dir, icon_size, offline))
+
+    def work(self):
+        """Decode queued icons while their size is still wanted"""
+        while True:
+            job = self.queue.get()
+            liststore, ref, ico, cache_dir, icon_size, offline = job
+            pxbf = None
+            if icon_size == self.apod.icon_size:
+                try:
+                    pxbf = self.apod.fetcher.get_thumbnail(
+                        ico, cache_dir, icon_size, offline)
+                except (urllib2.URLError, IOError, GLib.GError,
+                        sqlite3.Error) as err:
+                    log.warning("[ icon failed ] %s %s", ico, err)
+                except Exception:  # a bug must not cost a worker
+                    log.exception("[ icon failed ] %s", ico)
+            GLib.idle_add(self.set_thumbnail, liststore, ref, ico,
+                          icon_size, pxbf)
+
+    def set_thumbnail(self, liststore, ref, ico, icon_size, pxbf):
+        """Swap the decoded icon into its row, called from the main loop"""
+        self.pending.discard((ico, icon_size))
+        if (pxbf is not None and ref.valid() and
+                icon_size == self.apod.icon_size):
+            row = liststore[ref.get_path()]
+            row[0] = pxbf
+            row[6] = icon_size
+        return False
+
+
+#############
+## C L A S S
+###########################
+class MetaCacheAPOD:
+    """Store parsed APOD data on disk, keyed by date"""
+
+    def __init__(self, cache_dir, ttl=3600):
+        """Open or create the metadata database"""
+        self.db_path = os.path.join(cache_dir, 'metadata.db')
+        self.ttl = ttl  # seconds before today's entry is fetched again
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.conn.text_factory = str
+        with self.lock:
+            self.conn.execute('CREATE TABLE IF NOT EXISTS entries ('
+                              'date TEXT PRIMARY KEY, dat TEXT, img TEXT, '
+                              'ico TEXT, tit TEXT, inf TEXT, '
+                              'missing INTEGER, fetched REAL)')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS validators ('
+                              'url TEXT PRIMARY KEY, etag TEXT, '
+                              'modified TEXT, checked REAL, length INTEGER)')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS mirrored ('
+                              'date TEXT PRIMARY KEY)')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS dates ('
+                              'date TEXT PRIMARY KEY, tit TEXT)')
+            try:  # databases written before sizes were kept
+                self.conn.execute('ALTER TABLE validators '
+                                  'ADD COLUMN length INTEGER')
+            except sqlite3.OperationalError:
+                pass
+            self.search_module = self.create_search()
+            self.conn.commit()
+
+    def create_search(self):
+        """Create the full-text index of titles and explanations, filled
+        from the stored entries; return the sqlite module used for it"""
+        row = self.conn.execute("SELECT sql FROM sqlite_master "
+                                "WHERE name = 'search'").fetchone()
+        if row is not None:
+            for module in ('fts5', 'fts4'):
+                if module in row[0].lower():
+                    return module
+            return None
+        module = None
+        for name in ('fts5', 'fts4'):  # whichever this sqlite was built with
+            try:
+                self.conn.execute('CREATE VIRTUAL TABLE search USING ' +
+                                  name + '(date, tit, inf)')
+                module = name
+                break
+            except sqlite3.OperationalError:
+                pass
+        else:  # no full-text support, searched with LIKE instead
+            self.conn.execute('CREATE TABLE search (date TEXT, tit TEXT, '
+                              'inf TEXT)')
+        rows = self.conn.execute('SELECT date, tit, inf FROM entries '
+                                 'WHERE missing = 0').fetchall()
+        self.conn.executemany('INSERT INTO search (rowid, date, tit, inf) '
+                              'VALUES (?, ?, ?, ?)',
+                              [self.get_search_row(*row) for row in rows])
+        return module
+
+    def get_search_row(self, date, tit, inf):
+        """Row of the search index: a rowid from the date and plain text"""
+        return (int(date.replace('-', '')), date, tit,
+                re.sub(r'<[^>]*>', ' ', inf or ''))
+
+    def search(self, query, limit=-1):
+        """APOD data whose title or explanation has all the words of a
+        query (as prefixes), newest first"""
+        words = query.split()
+        if not words:
+            return []
+        if self.search_module is None:
+            where = ' AND '.join(['(s.tit LIKE ? OR s.inf LIKE ?)'] *
+                                 len(words))
+            args = []
+            for word in words:
+                args += ['%' + word + '%'] * 2
+        else:
+            where = 'search MATCH ?'
+            words = [word.replace('"', '""') for word in words]
+            if self.search_module == 'fts5':
+                args = [' '.join('"%s"*' % word for word in words)]
+            else:
+                args = [' '.join('"%s*"' % word for word in words)]
+        with self.lock:
+            rows = self.conn.execute('SELECT e.dat, e.img, e.ico, e.tit, '
+                                     'e.inf FROM search s JOIN entries e '
+                                     'ON e.date = s.date WHERE ' + where +
+                                     ' ORDER BY s.date DESC LIMIT ?',
+                                     args + [limit]).fetchall()
+        return [list(row) for row in rows]
+
+    def get(self, date):
+        """Return the APOD data, False if there is no APOD, None if unknown"""
+        with self.lock:
+            row = self.conn.execute('SELECT dat, img, ico, tit, inf, '
+                                    'missing, fetched FROM entries '
+                                    'WHERE date = ?',
+                                    (date.isoformat(),)).fetchone()
+        if row is None:
+            return None
+        # today's page may still change or be published later
+        if date >= datetime.date.today() and time.time() - row[6] > self.ttl:
+            return None
+        if row[5]:
+            return False
+        return list(row[:5])
+
+    def get_validators(self, url):
+        """ETag, Last-Modified, length and check time stored for a url"""
+        with self.lock:
+            row = self.conn.execute('SELECT etag, modified, length, checked '
+                                    'FROM validators WHERE url = ?',
+                                    (url,)).fetchone()
+        if row is None:
+            return None, None, None, None
+        return row
+
+    def put_validators(self, url, etag, modified, length):
+        """Store the validators of a url checked just now"""
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO validators '
+                              '(url, etag, modified, length, checked) '
+                              'VALUES (?, ?, ?, ?, ?)',
+                              (url, etag, modified, length, time.time()))
+            self.conn.commit()
+
+    def get_newest_date(self):
+        """Newest date in the index of dates with an APOD, or None"""
+        with self.lock:
+            row = self.conn.execute('SELECT MAX(date) FROM dates').fetchone()
+        if row[0] is None:
+            return None
+        return self.get_date(row[0])
+
+    def get_dates(self, date, count):
+        """Up to count indexed dates, from date backwards"""
+        with self.lock:
+            rows = self.conn.execute('SELECT date FROM dates WHERE date <= ? '
+                                     'ORDER BY date DESC LIMIT ?',
+                                     (date.isoformat(), count)).fetchall()
+        return [self.get_date(row[0]) for row in rows]
+
+    def get_dates_between(self, date_from, date_to):
+        """Indexed dates in a range, newest first"""
+        with self.lock:
+            rows = self.conn.execute('SELECT date FROM dates '
+                                     'WHERE date BETWEEN ? AND ? '
+                                     'ORDER BY date DESC',
+                                     (date_from.isoformat(),
+                                      date_to.isoformat())).fetchall()
+        return [self.get_date(row[0]) for row in rows]
+
+    def put_dates(self, dates):
+        """Add (date, title) pairs to the index of dates with an APOD"""
+        with self.lock:
+            self.conn.executemany('INSERT OR REPLACE INTO dates VALUES (?, ?)',
+                                  [(date.isoformat(), tit)
+                                   for date, tit in dates])
+            self.conn.commit()
+
+    def get_date(self, text):
+        """Date from its ISO format"""
+        return datetime.datetime.strptime(text, '%Y-%m-%d').date()
+
+    def is_mirrored(self, date):
+        """Whether a date was fully mirrored"""
+        with self.lock:
+            row = self.conn.execute('SELECT 1 FROM mirrored WHERE date = ?',
+                                    (date.isoformat(),)).fetchone()
+        return row is not None
+
+    def put_mirrored(self, date):
+        """Record a fully mirrored date"""
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO mirrored VALUES (?)',
+                              (date.isoformat(),))
+            self.conn.commit()
+
+    def put(self, date, apod_list):
+        """Store the APOD data for a date, or a negative entry if False"""
+        if apod_list is False:
+            values = [None] * 5 + [1]
+        else:
+            values = list(apod_list) + [0]
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO entries VALUES '
+                              '(?, ?, ?, ?, ?, ?, ?, ?)',
+                              [date.isoformat()] + values + [time.time()])
+            row = self.get_search_row(date.isoformat(), values[3], values[4])
+            self.conn.execute('DELETE FROM search WHERE rowid = ?', row[:1])
+            if apod_list is not False:
+                self.conn.execute('INSERT INTO search (rowid, date, tit, '
+                                  'inf) VALUES (?, ?, ?, ?)', row)
+            self.conn.commit()
+
+
+#############
+## C L A S S
+###########################
+class CacheAPOD:
+    """Keep the cache directory under a size budget, evicting LRU files"""
+
+    flush_interval = 30  # seconds between writes of the access times
+
+    def __init__(self, meta_cache, cache_dir, budget):
+        """Load the index of cached files"""
+        self.conn = meta_cache.conn  # share the metadata database
+        self.lock = meta_cache.lock
+        self.cache_dir = cache_dir
+        self.budget = budget  # bytes
+        self.pinned = {}  # files in use, never evicted
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.atimes = {}  # access times of hits not written yet
+        self.flushed = time.time()
+        with self.lock:
+            self.conn.execute('CREATE TABLE IF NOT EXISTS files ('
+                              'path TEXT PRIMARY KEY, size INTEGER, '
+                              'atime REAL)')
+            self.conn.commit()
+            count, total = self.conn.execute('SELECT COUNT(*), SUM(size) '
+                                             'FROM files').fetchone()
+        self.total = total or 0
+        if not count:
+            self.scan()
+
+    def scan(self):
+        """Index the files cached before the index existed"""
+        tile_dir = os.path.join(self.cache_dir, 'tiles')
+        for root, dirs, files in os.walk(self.cache_dir):
+            if root == tile_dir:  # each pyramid of tiles is one entry
+                for name in dirs:
+                    if not name.startswith('.'):
+                        self.add(os.path.join(root, name), False)
+                del dirs[:]
+                continue
+            for name in files:
+                if name.endswith('.jpg') or name.endswith('.png'):
+                    self.add(os.path.join(root, name), False)
+
+    def key(self, path):
+        """Index key of a file, relative to the cache directory"""
+        return os.path.relpath(path, self.cache_dir)
+
+    def hit(self, path):
+        """Count a cache hit and mark the file as used"""
+        stats.count('file hits')
+        with self.lock:
+            self.hits = self.hits + 1
+            self.atimes[self.key(path)] = time.time()
+            if time.time() - self.flushed >= self.flush_interval:
+                self.write_atimes()
+                self.conn.commit()
+
+    def flush(self):
+        """Write the access times of the hits so far, e.g. at exit"""
+        with self.lock:
+            self.write_atimes()
+            self.conn.commit()
+
+    def write_atimes(self):
+        """Update the access times of the hits, the lock held"""
+        if self.atimes:
+            self.conn.executemany('UPDATE files SET atime = ? WHERE path = ?',
+                                  [(atime, key) for key, atime in
+                                   self.atimes.items()])
+            self.atimes = {}
+        self.flushed = time.time()
+
+    def add(self, path, miss=True):
+        """Index a file written to the cache, then evict if over budget"""
+        key = self.key(path)
+        size = self.get_size(path)
+        if miss:
+            stats.count('file misses')
+        with self.lock:
+            if miss:
+                self.misses = self.misses + 1
+            row = self.conn.execute('SELECT size FROM files WHERE path = ?',
+                                    (key,)).fetchone()
+            if row is not None:
+                self.total = self.total - row[0]
+            self.atimes.pop(key, None)
+            self.write_atimes()  # in the same transaction
+            self.conn.execute('INSERT OR REPLACE INTO files VALUES '
+                              '(?, ?, ?)', (key, size, time.time()))
+            self.conn.commit()
+            self.total = self.total + size
+        self.evict(key)
+
+    def get_size(self, path):
+        """Size of a file, or of the files in a directory"""
+        if not os.path.isdir(path):
+            return os.path.getsize(path)
+        return sum(os.path.getsize(os.path.join(root, name))
+                   for root, dirs, files in os.walk(path) for name in files)
+
+    def evict(self, keep=None):
+        """Remove least recently used files until under budget"""
+        with self.lock:
+            if self.total <= self.budget:
+                return
+            self.write_atimes()  # the order must know the latest hits
+            rows = self.conn.execute('SELECT path, size FROM files '
+                                     'ORDER BY atime').fetchall()
+            for key, size in rows:
+                if self.total <= self.budget:
+                    break
+                if key == keep or key in self.pinned:
+                    continue
+                path = os.path.join(self.cache_dir, key)
+                if os.path.isdir(path):  # a pyramid of tiles
+                    shutil.rmtree(path, True)
+                else:
+                    try:
+                        os.remove(path)
+                    except OSError:  # already gone
+                        pass
+                self.conn.execute('DELETE FROM files WHERE path = ?', (key,))
+                self.total = self.total - size
+                self.evictions = self.evictions + 1
+            self.conn.commit()
+
+    def pin(self, path):
+        """Protect a file shown on screen from eviction"""
+        key = self.key(path)
+        with self.lock:
+            self.pinned[key] = self.pinned.get(key, 0) + 1
+
+    def unpin(self, path):
+        """Allow a file to be evicted again"""
+        key = self.key(path)
+        with self.lock:
+            self.pinned[key] = self.pinned.get(key, 1) - 1
+            if not self.pinned[key]:
+                del self.pinned[key]
+
+    def get_stats(self):
+        """Hit, miss and eviction counters"""
+        return self.hits, self.misses, self.evictions
+
+
+#############
+## C L A S S
+###########################
+class StoreAPOD:
+    """Content-addressed store of the downloads of every user of a host"""
+
+    max_digests = 4096  # digests of recent downloads kept in memory
+    grace = 24 * 3600  # seconds an unlinked object is kept for its viewers
+
+    def __init__(self, store_dir, apod_settings):
+        """Open the index and the HTTP client of the store"""
+        self.store_dir = store_dir
+        for name in ('urls', 'objects'):
+            if not os.path.isdir(os.path.join(store_dir, name)):
+                os.makedirs(os.path.join(store_dir, name))
+        self.meta_cache = MetaCacheAPOD(store_dir)
+        cache_size = apod_settings.get_option('cache_size')  # MiB
+        self.cache = CacheAPOD(self.meta_cache, store_dir,
+                               cache_size * 1024 * 1024)
+        self.http = HttpAPOD(self.meta_cache, self.cache,
+                             apod_settings.get_option('timeout'),
+                             apod_settings.get_option('retries'))
+        # content digest of each download and its version, least recent first
+        self.digests = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.evictions = None
+        self.sweep()
+
+    def fetch(self, url, progress=None):
+        """Download a url once for all clients; return its object file"""
+        ext = os.path.splitext(urlparse.urlsplit(url).path)[1].lower()
+        path = os.path.join(self.store_dir, 'urls',
+                            hashlib.sha1(url).hexdigest() + ext)
+        self.cache.pin(path)
+        try:
+            # clients asking for the same url wait here for one download
+            with self.http.file_lock(path):
+                self.http.fetch_locked(url, path, progress)
+                obj_name = self.link(path)
+        finally:
+            self.cache.unpin(path)
+        if self.cache.get_stats()[2] != self.evictions:
+            self.sweep()
+        return obj_name
+
+    def link(self, path):
+        """Hard link a download to the object named by its content"""
+        stat = os.stat(path)
+        version = stat.st_ino, stat.st_size, stat.st_mtime
+        with self.lock:
+            known, digest = self.digests.pop(path, (None, None))
+        if known != version:
+            digest = hashlib.sha256()
+            with open(path, 'rb') as down_file:
+                for chunk in iter(lambda: down_file.read(65536), ''):
+                    digest.update(chunk)
+            digest = digest.hexdigest()
+        obj_name = os.path.join(self.store_dir, 'objects', digest[:2], digest)
+        if not os.path.isdir(os.path.dirname(obj_name)):
+            try:
+                os.makedirs(os.path.dirname(obj_name))
+            except OSError:  # made by another thread
+                pass
+        try:
+            os.link(path, obj_name)
+        except OSError:
+            if not os.path.isfile(obj_name):
+                raise
+            if os.stat(obj_name).st_ino != stat.st_ino:
+                # same content under another url, keep a single copy
+                part_name = path + '.link'
+                if os.path.isfile(part_name):
+                    os.remove(part_name)
+                os.link(obj_name, part_name)
+                os.rename(part_name, path)
+                stat = os.stat(path)
+                version = stat.st_ino, stat.st_size, stat.st_mtime
+        with self.lock:
+            self.digests[path] = version, digest  # now the most recent
+            while len(self.digests) > self.max_digests:
+                self.digests.popitem(last=False)
+        return obj_name
+
+    def sweep(self):
+        """Remove the objects that no download has linked to for the grace
+        period; clients read objects in place and may still show them"""
+        self.evictions = self.cache.get_stats()[2]
+        obj_dir = os.path.join(self.store_dir, 'objects')
+        now = time.time()
+        for root, dirs, files in os.walk(obj_dir):
+            for name in files:
+                obj_name = os.path.join(root, name)
+                try:
+                    stat = os.stat(obj_name)
+                    # unlinking the download changed the object's ctime
+                    if (stat.st_nlink < 2 and
+                            now - stat.st_ctime > self.grace):
+                        os.remove(obj_name)
+                except OSError:  # removed by another thread
+                    pass
+
+
+#############
+## C L A S S
+###########################
+class CacheServerAPOD(SocketServer.ThreadingMixIn,
+                      SocketServer.UnixStreamServer):
+    """Local service sharing one store of downloads between processes"""
+
+    daemon_threads = True
+
+    def __init__(self, socket_path, store):
+        """Listen on a socket every user of the host can connect to"""
+        if os.path.exists(socket_path):
+            if SharedCacheAPOD(socket_path).is_serving():
+                raise socket.error('already serving on ' + socket_path)
+            os.remove(socket_path)  # left by a service that died
+        SocketServer.UnixStreamServer.__init__(self, socket_path,
+                                               CacheHandlerAPOD)
+        os.chmod(socket_path, 0o666)
+        self.store = store
+
+
+#############
+## C L A S S
+###########################
+class CacheHandlerAPOD(SocketServer.StreamRequestHandler):
+    """Answer one client: a url in, progress lines and a file path out"""
+
+    def handle(self):
+        """Fetch the url asked for, reporting progress as it downloads"""
+        self.connected = True
+        try:
+            url = json.loads(self.rfile.readline(65536))['url']
+            url = url.encode('utf-8')
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return self.send({'error': 'bad request'})
+        if not url.startswith(FetchAPOD.base_url):  # not an open proxy
+            return self.send({'error': 'not an APOD url: ' + url})
+        try:
+            path = self.server.store.fetch(url, self.progress)
+        except urllib2.HTTPError as err:
+            self.send({'error': str(err), 'code': err.code})
+        except (urllib2.URLError, IOError, OSError) as err:
+            log.warning("[ shared fetch failed ] %s %s", url, err)
+            self.send({'error': str(err)})
+        else:
+            self.send({'path': path})
+
+    def progress(self, done, total):
+        """Tell the client how far the download is"""
+        self.send({'done': done, 'total': total})
+
+    def send(self, reply):
+        """Write a line of JSON, unless the client hung up"""
+        if not self.connected:
+            return
+        try:
+            self.wfile.write(json.dumps(reply) + '\n')
+            self.wfile.flush()
+        except socket.error:  # finish the download for the other clients
+            self.connected = False
+
+
+#############
+## C L A S S
+###########################
+class SharedCacheAPOD:
+    """Client of the shared cache service, None means fetch it yourself"""
+
+    timeout = 300  # seconds without news from the service
+    retry_interval = 60  # seconds before looking for the service again
+
+    def __init__(self, socket_path):
+        """Remember where the service listens"""
+        self.socket_path = socket_path
+        self.down_until = 0
+
+    def connect(self):
+        """Socket connected to the service, or None if it is not running"""
+        if (time.time() < self.down_until or
+                not os.path.exists(self.socket_path)):
+            return None
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+        except socket.error:
+            sock.close()
+            self.down_until = time.time() + self.retry_interval
+            return None
+        return sock
+
+    def is_serving(self):
+        """Whether a service answers on the socket"""
+        sock = self.connect()
+        if sock is None:
+            return False
+        sock.close()
+        return True
+
+    def fetch(self, url, progress=None):
+        """Path of a url in the shared store, or None if there is none"""
+        sock = self.connect()
+        if sock is None:
+            return None
+        reply = {}
+        reply_file = sock.makefile('rb')
+        try:
+            sock.sendall(json.dumps({'url': url}) + '\n')
+            for line in reply_file:
+                reply = json.loads(line)
+                if 'done' not in reply:
+                    break
+                if progress is not None:
+                    progress(reply['done'], reply['total'])
+        except (socket.error, ValueError) as err:
+            reply = {'error': str(err)}
+            self.down_until = time.time() + self.retry_interval
+        finally:
+            reply_file.close()
+            sock.close()
+        if 'path' in reply:
+            stats.count('shared hits')
+            return reply['path'].encode('utf-8')
+        if 'code' in reply:  # the server said no, do not ask it again
+            raise urllib2.HTTPError(url, reply['code'], reply['error'],
+                                    None, None)
+        log.warning("[ no shared cache ] %s %s",
+                    url, reply.get('error', 'no reply'))
+        return None
+
+
+#############
+## C L A S S
+###########################
+class PrefetchAPOD:
+    """Download and decode pictures near the selection at low priority"""
+
+    def __init__(self, fetcher, preview, workers):
+        """Start the worker threads"""
+        self.fetcher = fetcher
+        self.preview = preview
+        self.queue = Queue.PriorityQueue()
+        self.generation = 0  # bumped on every new selection
+        self.opening = 0  # explicit Open downloads in progress
+        self.cond = threading.Condition()
+        self.workers = 0
+        self.set_workers(workers)
+
+    def set_workers(self, workers):
+        """Start or stop worker threads to have this many"""
+        workers = max(1, workers)
+        while self.workers < workers:
+            worker = threading.Thread(target=self.work)
+            worker.daemon = True
+            worker.start()
+            self.workers = self.workers + 1
+        while self.workers > workers:
+            self.queue.put((-1, 0, None, None))  # first in line, ends one
+            self.workers = self.workers - 1
+
+    def schedule(self, pictures):
+        """Replace the queued jobs with (url, file) pairs, nearest first"""
+        self.generation = self.generation + 1
+        for distance, (img, tmp_name) in enumerate(pictures):
+            self.queue.put((distance, -self.generation, img, tmp_name))
+
+    def begin_open(self):
+        """Hold back prefetch jobs while the user waits for a picture"""
+        with self.cond:
+            self.opening = self.opening + 1
+
+    def end_open(self):
+        """Let prefetch jobs run again"""
+        with self.cond:
+            self.opening = self.opening - 1
+            self.cond.notify_all()
+
+    def work(self):
+        """Run queued jobs of the latest selection"""
+        while True:
+            distance, generation, img, tmp_name = self.queue.get()
+            if img is None:  # fewer workers wanted
+                return
+            with self.cond:
+                while self.opening:
+                    self.cond.wait()
+            if -generation != self.generation:
+                continue  # the selection moved on
+            try:
+                tmp_name = self.fetcher.http.fetch_file(img, tmp_name)
+                self.preview.get_preview(tmp_name)
+            except (urllib2.URLError, IOError, GLib.GError,
+                    sqlite3.Error) as err:
+                log.warning("[ prefetch failed ] %s %s", img, err)
+
+
+#############
+## C L A S S
+###########################
+class PreviewAPOD:
+    """Decode previews of full-size pictures in the background"""
+
+    size = 500  # pixels, the longest side of a preview
+    capacity = 8  # previews kept in memory
+    chunk_size = 65536
+
+    def __init__(self, cache):
+        """Initialize the preview cache"""
+        self.cache = cache  # previews on disk are evicted like the rest
+        self.lock = threading.Lock()
+        self.recent = collections.OrderedDict()  # least recent first
+
+    def get_recent(self, tmp_name):
+        """Preview of a recently viewed picture, or None"""
+        with self.lock:
+            pxbf = self.recent.pop(tmp_name, None)
+            if pxbf is not None:
+                self.recent[tmp_name] = pxbf  # now the most recent
+        return pxbf
+
+    def load(self, tmp_name, done, error):
+        """Decode a preview on a worker thread, then call done with it"""
+        task = TaskAPOD(self.get_preview, (tmp_name,), done, error)
+        task.start()
+
+    def get_preview(self, tmp_name):
+        """Preview from memory, from disk, or decoded from the picture"""
+        pxbf = self.get_recent(tmp_name)
+        if pxbf is not None:
+            return pxbf
+        preview_dir = os.path.join(self.cache.cache_dir, 'previews')
+        preview_name = os.path.join(preview_dir,
+                                    os.path.basename(tmp_name) + '.png')
+        if (os.path.isfile(preview_name) and
+                os.path.getmtime(preview_name) >= os.path.getmtime(tmp_name)):
+            self.cache.hit(preview_name)
+            with stats.timer('decode', path=preview_name):
+                pxbf = GdkPixbuf.Pixbuf.new_from_file(preview_name)
+        else:
+            with stats.timer('decode', path=tmp_name):
+                pxbf = self.decode(tmp_name)
+            try:
+                os.makedirs(preview_dir)
+            except OSError:  # already there
+                pass
+            fd, part_name = tempfile.mkstemp(suffix='.png', dir=preview_dir)
+            os.close(fd)
+            try:
+                pxbf.savev(part_name, 'png', [], [])
+                os.rename(part_name, preview_name)
+            except (GLib.GError, OSError) as err:  # still show the preview
+                log.warning("[ preview not saved ] %s %s", preview_name, err)
+                if os.path.isfile(part_name):
+                    os.remove(part_name)
+            else:
+                self.cache.add(preview_name)
+        with self.lock:
+            self.recent[tmp_name] = pxbf
+            while len(self.recent) > self.capacity:
+                self.recent.popitem(last=False)
+        return pxbf
+
+    def decode(self, tmp_name):
+        """Decode a picture straight to preview size, chunk by chunk"""
+        loader = GdkPixbuf.PixbufLoader()
+        loader.connect('size-prepared', self.on_size_prepared)
+        try:
+            with open(tmp_name, 'rb') as pic:
+                while True:
+                    chunk = pic.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    loader.write(chunk)
+        finally:
+            loader.close()
+        return loader.get_pixbuf()
+
+    def on_size_prepared(self, loader, width, height):
+        """Ask the loader for the preview size only"""
+        scale = float(self.size) / max(width, height)
+        loader.set_size(max(1, int(round(width * scale))),
+                        max(1, int(round(height * scale))))
+
+
+#############
+## C L A S S
+###########################
+class PyramidAPOD:
+    """Tiles of a picture at halving resolutions, made once and kept on
+    disk so that a view decodes only the tiles it shows"""
+
+    tile_size = 256  # pixels
+    max_pixels = 40 * 1000 * 1000  # the finest level is at most this big
+    scaling_formats = ('jpeg',)  # loaders that scale while decoding
+    version = 1
+    build_lock = threading.Lock()  # one picture decoded at a time
+
+    def __init__(self, cache, tmp_name):
+        """Find the tiles of a cached picture"""
+        self.cache = cache
+        self.tmp_name = tmp_name
+        self.tile_dir = os.path.join(cache.cache_dir, 'tiles',
+                                     os.path.basename(tmp_name))
+        self.width = None  # of the finest level
+        self.height = None
+        self.levels = 0
+        self.ext = None
+
+    def load(self):
+        """Read the description of the tiles, False if not made yet"""
+        try:
+            with open(os.path.join(self.tile_dir, 'pyramid.json')) as meta:
+                pyramid = json.load(meta)
+        except (IOError, ValueError):
+            return False
+        if (pyramid.get('version') != self.version or
+                pyramid.get('source') != self.get_source()):
+            return False  # made from an older download
+        self.width = pyramid['width']
+        self.height = pyramid['height']
+        self.levels = pyramid['levels']
+        self.ext = pyramid['ext']
+        self.cache.hit(self.tile_dir)
+        return True
+
+    def get_source(self):
+        """Size and modification time of the picture"""
+        return [os.path.getsize(self.tmp_name),
+                os.path.getmtime(self.tmp_name)]
+
+    def get_level_size(self, level):
+        """Width and height of a level, the finest is level 0"""
+        width, height = self.width, self.height
+        for i in range(level):
+            width, height = (width + 1) // 2, (height + 1) // 2
+        return width, height
+
+    def get_tile_name(self, level, col, row, tile_dir=None):
+        """File of a tile"""
+        return os.path.join(tile_dir or self.tile_dir, str(level),
+                            '%d_%d.%s' % (col, row, self.ext))
+
+    def build(self):
+        """Make the tiles unless done before, on a worker thread; the
+        picture is decoded once, coarser levels are made from finer tiles"""
+        with self.build_lock:
+            if self.load():
+                return self
+            parent = os.path.dirname(self.tile_dir)
+            try:
+                os.makedirs(parent)
+            except OSError:  # already there
+                pass
+            part_dir = tempfile.mkdtemp(prefix='.part-', dir=parent)
+            try:
+                with stats.timer('tiles', path=self.tmp_name):
+                    self.cut(part_dir)
+                    level = 1
+                    while max(self.get_level_size(level - 1)) > \
+                            self.tile_size:
+                        self.merge(part_dir, level)
+                        level = level + 1
+                    self.levels = level
+                with open(os.path.join(part_dir, 'pyramid.json'), 'w') as meta:
+                    json.dump({'version': self.version,
+                               'source': self.get_source(),
+                               'width': self.width, 'height': self.height,
+                               'levels': self.levels, 'ext': self.ext}, meta)
+                if os.path.isdir(self.tile_dir):  # made from an old download
+                    shutil.rmtree(self.tile_dir, True)
+                os.rename(part_dir, self.tile_dir)
+            finally:
+                shutil.rmtree(part_dir, True)
+        self.cache.add(self.tile_dir)
+        return self
+
+    def cut(self, part_dir):
+        """Decode the picture and cut it into the tiles of level 0; other
+        loaders decode at full size before scaling, so max_pixels bounds
+        memory only for the scaling formats and larger pictures in other
+        formats are refused"""
+        info = GdkPixbuf.Pixbuf.get_file_info(self.tmp_name)
+        if info is None or info[0] is None:
+            raise IOError('not a picture: ' + self.tmp_name)
+        width, height = info[1], info[2]
+        if (width * height > self.max_pixels and
+                info[0].get_name() not in self.scaling_formats):
+            raise IOError('too big to decode as %s: %dx%d %s' %
+                          (info[0].get_name(), width, height, self.tmp_name))
+        scale = min(1.0, math.sqrt(float(self.max_pixels) / (width * height)))
+        self.width = max(1, int(width * scale))
+        self.height = max(1, int(height * scale))
+        pxbf = GdkPixbuf.Pixbuf.new_from_file_at_scale(self.tmp_name,
+                                                       self.width,
+                                                       self.height, False)
+        self.ext = 'png' if pxbf.get_has_alpha() else 'jpeg'
+        os.mkdir(os.path.join(part_dir, '0'))
+        size = self.tile_size
+        for row in range((self.height + size - 1) // size):
+            for col in range((self.width + size - 1) // size):
+                tile = pxbf.new_subpixbuf(col * size, row * size,
+                                          min(size, self.width - col * size),
+                                          min(size, self.height - row * size))
+                self.save(tile, self.get_tile_name(0, col, row, part_dir))
+
+    def merge(self, part_dir, level):
+        """Make the tiles of a level from 2x2 tiles of the finer one"""
+        width, height = self.get_level_size(level - 1)
+        size = self.tile_size
+        os.mkdir(os.path.join(part_dir, str(level)))
+        for row in range((height + 2 * size - 1) // (2 * size)):
+            for col in range((width + 2 * size - 1) // (2 * size)):
+                block = None
+                for dy in range(2):
+                    for dx in range(2):
+                        name = self.get_tile_name(level - 1, 2 * col + dx,
+                                                  2 * row + dy, part_dir)
+                        if not os.path.isfile(name):  # past the edge
+                            continue
+                        tile = GdkPixbuf.Pixbuf.new_from_file(name)
+                        if block is None:
+                            block = GdkPixbuf.Pixbuf.new(
+                                GdkPixbuf.Colorspace.RGB,
+                                tile.get_has_alpha(), 8,
+                                min(2 * size, width - 2 * col * size),
+                                min(2 * size, height - 2 * row * size))
+                        tile.copy_area(0, 0, tile.get_width(),
+                                       tile.get_height(), block,
+                                       dx * size, dy * size)
+                half = block.scale_simple((block.get_width() + 1) // 2,
+                                          (block.get_height() + 1) // 2,
+                                          GdkPixbuf.InterpType.BILINEAR)
+                self.save(half, self.get_tile_name(level, col, row, part_dir))
+
+    def save(self, tile, name):
+        """Write a tile"""
+        if self.ext == 'jpeg':
+            tile.savev(name, 'jpeg', ['quality'], ['90'])
         else:
-            # write a default config file
-            days_numb = '7'
-            icon_size = '50'
-            self.conf_file.add_section('pyapod_settings')
-            self.conf_file.set('pyapod_settings', 'days', days_numb)
-            self.conf_file.set('pyapod_settings', 'size', icon_size)
-            self.conf_file.write(open(self.conf_path, 'w'))
-        return int(days_numb), int(icon_size)
-
-    def write_settings(self, days_numb_new, icon_size_new):
-        """Write data to config file"""
-        self.conf_file.set('pyapod_settings', 'days', str(days_numb_new))
-        self.conf_file.set('pyapod_settings', 'size', str(icon_size_new))
-        self.conf_file.write(open(self.conf_path, 'w'))
-        return
+            tile.savev(name, 'png', [], [])
+
+
+#############
+## C L A S S
+###########################
+class ZoomAPOD(Gtk.DrawingArea):
+    """Zoomable and pannable picture, drawn from the preview and from the
+    tiles of a pyramid once there is one"""
+
+    __gsignals__ = {'zoomed': (GObject.SIGNAL_RUN_FIRST, None, ())}
+
+    zoom_step = 1.25
+    max_scale = 2.0  # screen pixels per picture pixel at most
+    min_tiles = 64  # tiles kept in memory, more for a bigger window
+
+    def __init__(self, size):
+        """Initialize the view, showing nothing yet"""
+        Gtk.DrawingArea.__init__(self)
+        self.set_size_request(size, size)
+        self.set_hexpand(True)
+        self.set_vexpand(True)
+        self.add_events(Gdk.EventMask.BUTTON_PRESS_MASK |
+                        Gdk.EventMask.BUTTON_RELEASE_MASK |
+                        Gdk.EventMask.POINTER_MOTION_MASK |
+                        Gdk.EventMask.SCROLL_MASK)
+        self.connect('draw', self.on_draw)
+        self.connect('scroll-event', self.on_scroll)
+        self.connect('button-press-event', self.on_button_press)
+        self.connect('button-release-event', self.on_button_release)
+        self.connect('motion-notify-event', self.on_motion)
+        self.connect('destroy', self.on_destroy)
+        self.icon = None  # shown instead while there is no picture
+        self.preview = None
+        self.pyramid = None
+        self.magnify = 1.0  # 1 fits the picture in the window
+        self.center = [0.5, 0.5]  # picture point at the window center
+        self.drag = None
+        self.tiles = collections.OrderedDict()  # least recent first
+        self.capacity = self.min_tiles
+        self.pending = set()
+        self.in_view = frozenset()  # tile keys of the latest draw
+        self.queue = Queue.LifoQueue()  # latest requests are in view
+        worker = threading.Thread(target=self.work)
+        worker.daemon = True
+        worker.start()
+
+    def set_icon(self, name):
+        """Show a themed icon, while loading or after an error"""
+        try:
+            self.icon = Gtk.IconTheme.get_default().load_icon(name, 48, 0)
+        except GLib.GError:  # no such icon in the theme
+            self.icon = None
+        self.queue_draw()
+
+    def set_preview(self, pxbf):
+        """Show the whole picture at preview size"""
+        self.icon = None
+        self.preview = pxbf
+        self.queue_draw()
+
+    def set_pyramid(self, pyramid):
+        """Draw from the tiles of a pyramid"""
+        self.pyramid = pyramid
+        self.queue_draw()
+
+    def get_picture_size(self):
+        """Size of the picture drawn, None if there is none yet"""
+        if self.pyramid is not None:
+            return self.pyramid.width, self.pyramid.height
+        if self.preview is not None:
+            return self.preview.get_width(), self.preview.get_height()
+        return None
+
+    def get_scale(self, width, height):
+        """Screen pixels per picture pixel"""
+        picture_width, picture_height = self.get_picture_size()
+        fit = min(float(width) / picture_width,
+                  float(height) / picture_height)
+        return fit * self.magnify
+
+    def zoom(self, factor, x=None, y=None):
+        """Zoom by a factor, keeping the point at (x, y) in place"""
+        size = self.get_picture_size()
+        if size is None:
+            return
+        width = self.get_allocated_width()
+        height = self.get_allocated_height()
+        if x is None:
+            x, y = width / 2.0, height / 2.0
+        scale = self.get_scale(width, height)
+        fit = scale / self.magnify
+        magnify = self.magnify * factor
+        magnify = max(1.0, min(magnify, max(1.0, self.max_scale / fit)))
+        new_scale = fit * magnify
+        for axis, offset, length in ((0, x - width / 2.0, size[0]),
+                                     (1, y - height / 2.0, size[1])):
+            point = self.center[axis] + offset / (scale * length)
+            self.center[axis] = point - offset / (new_scale * length)
+        self.magnify = magnify
+        self.clamp()
+        self.queue_draw()
+        self.emit('zoomed')
+
+    def zoom_fit(self):
+        """Show the whole picture"""
+        self.magnify = 1.0
+        self.center = [0.5, 0.5]
+        self.queue_draw()
+
+    def clamp(self):
+        """Keep the picture in the window, centered if it is smaller"""
+        size = self.get_picture_size()
+        width = self.get_allocated_width()
+        height = self.get_allocated_height()
+        scale = self.get_scale(width, height)
+        for axis, window in ((0, width), (1, height)):
+            half = window / (2.0 * scale * size[axis])  # window half-size
+            if half >= 0.5:
+                self.center[axis] = 0.5
+            else:
+                self.center[axis] = max(half, min(self.center[axis],
+                                                  1.0 - half))
+
+    def on_scroll(self, widget, event):
+        """Zoom in or out at the pointer"""
+        if event.direction == Gdk.ScrollDirection.UP:
+            self.zoom(self.zoom_step, event.x, event.y)
+        elif event.direction == Gdk.ScrollDirection.DOWN:
+            self.zoom(1 / self.zoom_step, event.x, event.y)
+        return True
+
+    def on_button_press(self, widget, event):
+        """Start dragging the picture"""
+        if event.button == 1:
+            self.drag = (event.x, event.y, list(self.center))
+        return True
+
+    def on_button_release(self, widget, event):
+        """Stop dragging the picture"""
+        self.drag = None
+        return True
+
+    def on_motion(self, widget, event):
+        """Pan while dragging"""
+        if self.drag is None or self.get_picture_size() is None:
+            return False
+        x, y, center = self.drag
+        size = self.get_picture_size()
+        scale = self.get_scale(self.get_allocated_width(),
+                               self.get_allocated_height())
+        self.center = [center[0] - (event.x - x) / (scale * size[0]),
+                       center[1] - (event.y - y) / (scale * size[1])]
+        self.clamp()
+        self.queue_draw()
+        return True
+
+    def on_draw(self, widget, cr):
+        """Paint the preview, then the tiles in view on top of it"""
+        width = self.get_allocated_width()
+        height = self.get_allocated_height()
+        if self.icon is not None:
+            self.paint(cr, self.icon, (width - self.icon.get_width()) / 2,
+                       (height - self.icon.get_height()) / 2, 1.0)
+            return False
+        size = self.get_picture_size()
+        if size is None:
+            return False
+        scale = self.get_scale(width, height)
+        left = width / 2.0 - self.center[0] * size[0] * scale
+        top = height / 2.0 - self.center[1] * size[1] * scale
+        if self.preview is not None:
+            self.paint(cr, self.preview, left, top,
+                       size[0] * scale / self.preview.get_width())
+        if self.pyramid is None:
+            return False
+        # the coarsest level still as sharp as the screen
+        level = 0
+        if scale < 1:
+            level = min(self.pyramid.levels - 1,
+                        int(math.floor(math.log(1 / scale, 2))))
+        factor = 2 ** level * scale  # screen pixels per level pixel
+        tile = self.pyramid.tile_size * factor
+        level_width, level_height = self.pyramid.get_level_size(level)
+        cols = range(max(0, int((0 - left) // tile)),
+                     min((level_width - 1) // self.pyramid.tile_size,
+                         int((width - left) // tile)) + 1)
+        rows = range(max(0, int((0 - top) // tile)),
+                     min((level_height - 1) // self.pyramid.tile_size,
+                         int((height - top) // tile)) + 1)
+        self.in_view = frozenset((level, col, row)
+                                 for row in rows for col in cols)
+        self.capacity = max(self.min_tiles, 2 * len(cols) * len(rows))
+        for row in rows:
+            for col in cols:
+                pxbf = self.get_tile((level, col, row))
+                if pxbf is not None:
+                    self.paint(cr, pxbf, left + col * tile, top + row * tile,
+                               factor)
+        return False
+
+    def paint(self, cr, pxbf, x, y, scale):
+        """Paint a pixbuf at a position and scale"""
+        cr.save()
+        cr.translate(x, y)
+        cr.scale(scale, scale)
+        Gdk.cairo_set_source_pixbuf(cr, pxbf, 0, 0)
+        cr.paint()
+        cr.restore()
+
+    def get_tile(self, key):
+        """Decoded tile, or None after asking for it"""
+        pxbf = self.tiles.pop(key, None)
+        if pxbf is not None:
+            self.tiles[key] = pxbf  # now the most recent
+        elif key not in self.pending:
+            self.pending.add(key)
+            self.queue.put((self.pyramid, key))
+        return pxbf
+
+    def work(self):
+        """Decode the asked tiles that are still in view"""
+        while True:
+            job = self.queue.get()
+            if job is None:  # the view is gone
+                return
+            pyramid, key = job
+            if key not in self.in_view:  # scrolled or zoomed away
+                GLib.idle_add(self.set_tile, key, None, True)
+                continue
+            pxbf = None
+            try:
+                pxbf = GdkPixbuf.Pixbuf.new_from_file(
+                    pyramid.get_tile_name(*key))
+            except GLib.GError as err:
+                log.warning("[ tile failed ] %s %s", key, err)
+            GLib.idle_add(self.set_tile, key, pxbf, False)
+
+    def set_tile(self, key, pxbf, dropped):
+        """Keep a decoded tile and draw it, called from the main loop"""
+        self.pending.discard(key)
+        if dropped and key in self.in_view:  # back in view, ask again
+            self.queue_draw()
+        elif pxbf is not None:
+            self.tiles[key] = pxbf
+            while len(self.tiles) > self.capacity:
+                self.tiles.popitem(last=False)
+            self.queue_draw()
+        return False
+
+    def on_destroy(self, widget):
+        """Stop the worker and drop the tiles"""
+        self.queue.put(None)
+        self.tiles.clear()
 
 
 #############
@@ -368,29 +3023,52 @@ class SettingsAPOD:
 class ViewAPOD(Gtk.Window):
     """View and save selected APOD image"""
 
-    def __init__(self, tit, dat, img_name, tmp_name, inf):
+    def __init__(self, tit, dat, img_name, tmp_name, inf, cache=None,
+                 preview=None):
         """Initialize the window"""
         Gtk.Window.__init__(self)
         self.img_name = img_name
         self.tmp_name = tmp_name
+        self.closed = False
+        self.connect('destroy', self.on_destroy)
+        self.pyramid = None  # tiles for zooming, made on the first zoom
+        self.building = False
+        if cache is not None:  # keep the picture while it is shown; one
+            # in the shared store is kept for StoreAPOD.grace once unlinked
+            self.pyramid = PyramidAPOD(cache, tmp_name)
+            for path in (tmp_name, self.pyramid.tile_dir):
+                cache.pin(path)
+                self.connect('destroy',
+                             lambda widget, path=path: cache.unpin(path))
         name = "APOD from " + dat + " - " + tit
         self.set_title(name)
-        self.set_resizable(False)
+        self.set_resizable(True)
         self.set_position(Gtk.WindowPosition.CENTER)
         self.set_border_width(10)
 
         self.grid = Gtk.Grid(column_spacing=10, row_spacing=10)
         self.add(self.grid)
 
-        # create the image
-        self.image = Gtk.Image()
-
-        # create and add the pixbuf
-        self.pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_scale(tmp_name,
-                                                              500,
-                                                              500,
-                                                              True)
-        self.image.set_from_pixbuf(self.pixbuf)
+        # create the zoomable image
+        self.image = ZoomAPOD(500)
+        self.image.connect('zoomed', self.on_zoomed)
+        if self.pyramid is not None and self.pyramid.load():
+            self.image.set_pyramid(self.pyramid)
+
+        # create and add the pixbuf, decoded in the background if needed
+        recent = None
+        if preview is not None:
+            recent = preview.get_recent(tmp_name)  # may be evicted after
+        if preview is None:
+            self.set_pixbuf(GdkPixbuf.Pixbuf.new_from_file_at_scale(tmp_name,
+                                                                    500,
+                                                                    500,
+                                                                    True))
+        elif recent is not None:
+            self.set_pixbuf(recent)
+        else:
+            self.image.set_icon('image-loading')
+            preview.load(tmp_name, self.set_pixbuf, self.on_preview_error)
         self.grid.add(self.image)
 
         # create the buttons: Info and Save
@@ -412,12 +3090,61 @@ class ViewAPOD(Gtk.Window):
         self.buttonbox.set_child_secondary(self.button_save,
                                            is_secondary=True)
 
+        self.button_zoom_in = Gtk.Button(stock=Gtk.STOCK_ZOOM_IN)
+        self.button_zoom_in.connect('clicked', lambda widget:
+                                    self.image.zoom(self.image.zoom_step))
+        self.buttonbox.add(self.button_zoom_in)
+
+        self.button_zoom_out = Gtk.Button(stock=Gtk.STOCK_ZOOM_OUT)
+        self.button_zoom_out.connect('clicked', lambda widget:
+                                     self.image.zoom(1 / self.image.zoom_step))
+        self.buttonbox.add(self.button_zoom_out)
+
+        self.button_zoom_fit = Gtk.Button(stock=Gtk.STOCK_ZOOM_FIT)
+        self.button_zoom_fit.connect('clicked',
+                                     lambda widget: self.image.zoom_fit())
+        self.buttonbox.add(self.button_zoom_fit)
+
         self.button_close = Gtk.Button(stock=Gtk.STOCK_CLOSE)
         self.button_close.connect('clicked', self.on_button_close_clicked)
         self.buttonbox.add(self.button_close)
 
         self.show_all()
 
+    def set_pixbuf(self, pixbuf):
+        """Show the decoded picture"""
+        if not self.closed:
+            self.pixbuf = pixbuf
+            self.image.set_preview(pixbuf)
+
+    def on_preview_error(self, err):
+        """Report a picture that could not be decoded"""
+        log.warning("[ decode failed ] %s %s", self.tmp_name, err)
+        if not self.closed:
+            self.image.set_icon('image-missing')
+
+    def on_zoomed(self, widget):
+        """Make the tiles in the background the first time it is zoomed"""
+        if (self.pyramid is not None and self.image.pyramid is None and
+                not self.building):
+            self.building = True
+            task = TaskAPOD(self.pyramid.build, (), self.on_pyramid_ready,
+                            self.on_pyramid_error)
+            task.start()
+
+    def on_pyramid_ready(self, pyramid):
+        """Draw from the tiles from now on"""
+        if not self.closed:
+            self.image.set_pyramid(pyramid)
+
+    def on_pyramid_error(self, err):
+        """Report tiles that could not be made, zooming the preview only"""
+        log.warning("[ tiles failed ] %s %s", self.tmp_name, err)
+
+    def on_destroy(self, widget):
+        """Forget the window, a late preview is dropped"""
+        self.closed = True
+
     # callback for button Info
     def on_button_info_clicked(self, widget, tit, dat, inf):
         """Show info about current picture"""
@@ -438,11 +3165,24 @@ class ViewAPOD(Gtk.Window):
 
         response = save_dialog.run()
         if response == Gtk.ResponseType.ACCEPT:
-            pic = urllib2.urlopen('file://' + tmp_name).read()
             fname = save_dialog.get_filename()
-            open(fname, 'wb').write(pic)
+            task = TaskAPOD(ExportAPOD.copy_file, (tmp_name, fname),
+                            lambda result: None, self.on_save_error)
+            task.start()
         save_dialog.destroy()
 
+    def on_save_error(self, err):
+        """Report a failed save, called from the main loop"""
+        log.warning("[ save failed ] %s", err)
+        error_dialog = Gtk.MessageDialog(self,
+                                         0,
+                                         Gtk.MessageType.ERROR,
+                                         Gtk.ButtonsType.CLOSE,
+                                         "The picture was not saved.")
+        error_dialog.format_secondary_text(str(err))
+        error_dialog.run()
+        error_dialog.destroy()
+
     # callback for button Close
     def on_button_close_clicked(self, widget):
         """Destroy window ViewAPOD"""
@@ -515,8 +3255,11 @@ class PrefsAPOD(Gtk.Dialog):
         self.set_modal(True)
 
         # get settings
-        apod_settings = SettingsAPOD()
+        apod_settings = SettingsAPOD.get_instance()
         days, size = apod_settings.get_settings()
+        jobs = apod_settings.get_option('jobs')
+        cache_size = apod_settings.get_option('cache_size')
+        prefetch = apod_settings.get_option('prefetch')
 
         # grid
         self.grid = Gtk.Grid(column_spacing=5, row_spacing=5)
@@ -549,18 +3292,247 @@ class PrefsAPOD(Gtk.Dialog):
         self.spin_size.set_value(size)
         self.grid.attach(self.spin_size, 1, 1, 1, 1)
 
+        # label
+        self.label_jobs = Gtk.Label('Parallel downloads:')
+        self.label_jobs.set_alignment(0, 0)
+        self.grid.attach(self.label_jobs, 0, 2, 1, 1)
+
+        # adjustment
+        adjust_jobs = Gtk.Adjustment(1, 1, 16, 1, 4, 0)
+
+        # spin button
+        self.spin_jobs = Gtk.SpinButton()
+        self.spin_jobs.set_adjustment(adjust_jobs)
+        self.spin_jobs.set_value(jobs)
+        self.grid.attach(self.spin_jobs, 1, 2, 1, 1)
+
+        # label
+        self.label_cache = Gtk.Label('Cache size (MiB):')
+        self.label_cache.set_alignment(0, 0)
+        self.grid.attach(self.label_cache, 0, 3, 1, 1)
+
+        # adjustment
+        adjust_cache = Gtk.Adjustment(500, 50, 100000, 50, 500, 0)
+
+        # spin button
+        self.spin_cache = Gtk.SpinButton()
+        self.spin_cache.set_adjustment(adjust_cache)
+        self.spin_cache.set_value(cache_size)
+        self.grid.attach(self.spin_cache, 1, 3, 1, 1)
+
+        # check button
+        self.check_prefetch = Gtk.CheckButton(
+            'Prefetch pictures near the selection')
+        self.check_prefetch.set_active(prefetch)
+        self.grid.attach(self.check_prefetch, 0, 4, 2, 1)
+
         box = self.get_content_area()
         box.add(self.grid)
         self.show_all()
 
 
+#############
+## C L A S S
+###########################
+class StatsAPOD:
+    """Time the stages of the pipeline and count what goes through it"""
+
+    def __init__(self):
+        """Start with no stages timed"""
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.stages = collections.OrderedDict()  # name: [count, total, max]
+        self.counters = collections.Counter()
+        self.trace = None
+        self.events = 0
+
+    def open_trace(self, path):
+        """Write every timed stage to a Chrome trace event file"""
+        self.trace = open(path, 'w')
+        self.trace.write('[')
+
+    def close_trace(self):
+        """Finish the trace file"""
+        if self.trace is not None:
+            self.trace.write(']\n')
+            self.trace.close()
+            self.trace = None
+
+    @contextlib.contextmanager
+    def timer(self, stage, **args):
+        """Context timing one run of a stage"""
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add(stage, start, time.time() - start, args)
+
+    def add(self, stage, start, seconds, args=None):
+        """Record one run of a stage"""
+        with self.lock:
+            entry = self.stages.setdefault(stage, [0, 0.0, 0.0])
+            entry[0] = entry[0] + 1
+            entry[1] = entry[1] + seconds
+            entry[2] = max(entry[2], seconds)
+            if self.trace is not None:
+                event = {'name': stage, 'ph': 'X', 'pid': os.getpid(),
+                         'tid': threading.current_thread().ident,
+                         'ts': int((start - self.started) * 1e6),
+                         'dur': int(seconds * 1e6), 'args': args or {}}
+                if self.events:
+                    self.trace.write(',')
+                self.trace.write('\n' + json.dumps(event, default=str))
+                self.events = self.events + 1
+        log.debug("[ timer ] %s %.3f s %s", stage, seconds, args or '')
+
+    def count(self, name, value=1):
+        """Add to a counter"""
+        with self.lock:
+            self.counters[name] = self.counters[name] + value
+
+    def get_summary(self):
+        """Lines describing the stages and counters so far"""
+        lines = ['%-10s %7s %9s %9s %9s' % ('stage', 'runs', 'total s',
+                                             'mean ms', 'max ms')]
+        with self.lock:
+            for stage, (runs, total, most) in self.stages.items():
+                lines.append('%-10s %7d %9.3f %9.1f %9.1f' %
+                             (stage, runs, total, total * 1000 / runs,
+                              most * 1000))
+            for name in sorted(self.counters):
+                lines.append('%-20s %d' % (name, self.counters[name]))
+        lines.append('%-20s %.3f' % ('elapsed s', time.time() - self.started))
+        return lines
+
+
+stats = StatsAPOD()  # shared by the whole pipeline
+
+
+#############
+## C L A S S
+###########################
+class FormatterAPOD(logging.Formatter):
+    """Colour the [ tag ] of log messages, for terminals only"""
+
+    colors = {logging.DEBUG: GREEN, logging.INFO: BLUE}  # else RED
+    tag = re.compile(r'^\[ (.*?) \]')
+
+    def format(self, record):
+        """Format the message, then colour its tag by level"""
+        text = logging.Formatter.format(self, record)
+        color = self.colors.get(record.levelno, RED)
+        return self.tag.sub(lambda match: '[ ' + color + match.group(1) +
+                            RESET + ' ]', text, 1)
+
+
+def parse_date(text):
+    """Date from a YYYY-MM-DD string or 'today'"""
+    if text == 'today':
+        return datetime.date.today()
+    try:
+        return datetime.datetime.strptime(text, '%Y-%m-%d').date()
+    except ValueError:
+        raise argparse.ArgumentTypeError('not a YYYY-MM-DD date: ' + text)
+
+
 def main():
-    """Show the window"""
+    """Show the window, or mirror the archive without it"""
+    parser = argparse.ArgumentParser(
+        description='View images from NASA APOD web site.')
+    parser.add_argument('--mirror', action='store_true',
+                        help='download pages, icons and pictures into the '
+                             'cache and exit, without a window')
+    parser.add_argument('--from', dest='date_from', type=parse_date,
+                        default=FetchAPOD.first_date, metavar='DATE',
+                        help='first date to mirror (default 1995-06-16)')
+    parser.add_argument('--to', dest='date_to', type=parse_date,
+                        default=datetime.date.today(), metavar='DATE',
+                        help='last date to mirror (default today)')
+    parser.add_argument('--jobs', type=int, metavar='N',
+                        help='parallel downloads (default from settings)')
+    parser.add_argument('--search', metavar='WORDS',
+                        help='list the cached APODs whose title or '
+                             'explanation have these words and exit')
+    parser.add_argument('--serve-cache', metavar='DIR',
+                        help='serve a cache in DIR shared by every user '
+                             'and instance on this host, without a window')
+    parser.add_argument('--socket', metavar='PATH',
+                        help='socket of the shared cache '
+                             '(default DIR/cache.sock)')
+    parser.add_argument('--debug', action='store_true',
+                        help='log every file found and stage timed')
+    parser.add_argument('--trace', metavar='FILE',
+                        help='write the timed stages to a Chrome trace '
+                             'event file (see chrome://tracing)')
+    parser.add_argument('--profile', action='store_true',
+                        help='print stage timings and counters at exit')
+    args = parser.parse_args()
+
+    handler = logging.StreamHandler()
+    if handler.stream.isatty():  # plain text for files and pipes
+        handler.setFormatter(FormatterAPOD('%(message)s'))
+    else:
+        handler.setFormatter(logging.Formatter('%(message)s'))
+    log.addHandler(handler)
+    log.setLevel(logging.DEBUG if args.debug else logging.INFO)
+    if args.trace:
+        stats.open_trace(args.trace)
+    try:
+        return run(args)
+    finally:
+        stats.close_trace()
+        if args.profile:
+            for line in stats.get_summary():
+                print "[ " + BLUE + "profile" + RESET + " ]", line
+
+
+def run(args):
+    """Run the mode asked for on the command line"""
+    if args.search:
+        fetcher = FetchAPOD(SettingsAPOD.get_instance())
+        for apod_list in fetcher.search(args.search):
+            print apod_list[0] + '  ' + apod_list[3]
+        return 0
+
+    if args.serve_cache:
+        os.umask(0o022)  # the store is readable by every user
+        store = StoreAPOD(args.serve_cache, SettingsAPOD.get_instance())
+        server = CacheServerAPOD(args.socket or
+                                 os.path.join(args.serve_cache, 'cache.sock'),
+                                 store)
+        log.info("[ serving ] %s", server.server_address)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            os.remove(server.server_address)
+            store.cache.flush()
+        return 0
+
+    if args.mirror:
+        fetcher = FetchAPOD(SettingsAPOD.get_instance())
+        failed = fetcher.mirror(args.date_from, args.date_to,
+                                args.jobs or fetcher.jobs)
+        fetcher.cache.flush()
+        return 1 if failed else 0
+
+    if isinstance(Gtk, MissingAPOD):
+        log.error("[ no window ] %s, try --mirror, "
+                  "--search or --serve-cache", Gtk.error)
+        return 1
+    GObject.threads_init()
     win = APOD()
     win.connect('delete-event', Gtk.main_quit)
     win.show_all()
     Gtk.main()
+    win.save_snapshot()
+    win.cache.flush()
+    hits, misses, evictions = win.cache.get_stats()
+    log.info("[ cache ] hits = %s misses = %s "
+             "evictions = %s", hits, misses, evictions)
     return 0
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
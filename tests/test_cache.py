@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Tests of the size budget of the cache directory.
+
+    python -m unittest discover tests
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+
+import pyAPOD
+
+
+class CacheTest(unittest.TestCase):
+    """CacheAPOD evicting least recently used files"""
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp(prefix='pyapod-test-')
+        self.meta_cache = pyAPOD.MetaCacheAPOD(self.cache_dir)
+        self.cache = pyAPOD.CacheAPOD(self.meta_cache, self.cache_dir, 3000)
+
+    def tearDown(self):
+        self.meta_cache.conn.close()
+        shutil.rmtree(self.cache_dir)
+
+    def add(self, name, size=1000):
+        """Write a file of a size to the cache"""
+        path = os.path.join(self.cache_dir, name)
+        with open(path, 'wb') as cached:
+            cached.write('x' * size)
+        self.cache.add(path)
+        return path
+
+    def test_add_under_budget(self):
+        """Files within the budget are all kept and counted"""
+        paths = [self.add(name) for name in ('a.jpg', 'b.jpg', 'c.jpg')]
+        self.assertTrue(all(os.path.isfile(path) for path in paths))
+        self.assertEqual(self.cache.total, 3000)
+        self.assertEqual(self.cache.get_stats(), (0, 3, 0))
+
+    def test_evict_least_recent(self):
+        """Going over budget removes the file used least recently"""
+        a = self.add('a.jpg')
+        b = self.add('b.jpg')
+        c = self.add('c.jpg')
+        self.cache.hit(a)  # b is now the least recent
+        d = self.add('d.jpg')
+        self.assertFalse(os.path.exists(b))
+        for path in (a, c, d):
+            self.assertTrue(os.path.isfile(path), path)
+        self.assertEqual(self.cache.total, 3000)
+        self.assertEqual(self.cache.get_stats(), (1, 4, 1))
+
+    def test_pinned_kept(self):
+        """A pinned file is skipped until unpinned"""
+        a = self.add('a.jpg')
+        b = self.add('b.jpg')
+        self.add('c.jpg')
+        self.cache.pin(a)
+        self.add('d.jpg')
+        self.assertTrue(os.path.isfile(a))
+        self.assertFalse(os.path.exists(b))
+        self.cache.unpin(a)
+        self.add('e.jpg')
+        self.assertFalse(os.path.exists(a))
+
+    def test_smaller_budget(self):
+        """Lowering the budget evicts down to it, oldest first"""
+        paths = [self.add(name) for name in ('a.jpg', 'b.jpg', 'c.jpg')]
+        self.cache.budget = 1000
+        self.cache.evict()
+        self.assertEqual([os.path.exists(path) for path in paths],
+                         [False, False, True])
+
+    def test_hits_survive_reopen(self):
+        """Access times flushed at exit order the next run's evictions"""
+        a = self.add('a.jpg')
+        b = self.add('b.jpg')
+        self.add('c.jpg')
+        self.cache.hit(a)
+        self.cache.flush()
+        cache = pyAPOD.CacheAPOD(self.meta_cache, self.cache_dir, 2000)
+        cache.evict()
+        self.assertTrue(os.path.isfile(a))
+        self.assertFalse(os.path.exists(b))
+
+
+if __name__ == '__main__':
+    unittest.main()
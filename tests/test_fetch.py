@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Tests of downloads and date planning against the benchmark's local
+stand-in for the APOD web site.
+
+    python -m unittest discover tests
+"""
+
+import os
+import sys
+import shutil
+import datetime
+import tempfile
+import unittest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+
+import pyAPOD
+import benchmark
+
+
+class ServerAPOD(benchmark.MockServerAPOD):
+    """The stand-in with made up bytes for pictures, never decoded here"""
+
+    def make_jpeg(self, width, height, rand):
+        """Random bytes, a tenth of the pixels"""
+        return ''.join(chr(rand.randint(0, 255))
+                       for i in range(width * height // 10))
+
+
+class FetchTestCase(unittest.TestCase):
+    """A fetcher with an empty HOME, against the stand-in"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ServerAPOD(gaps=0.2, archive_days=60)
+        cls.server.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.home = tempfile.mkdtemp(prefix='pyapod-test-')
+        self.old_home = os.environ.get('HOME')
+        os.environ['HOME'] = self.home
+        self.fetcher = pyAPOD.FetchAPOD(pyAPOD.SettingsAPOD())
+        self.fetcher.base_url = self.server.get_url()
+        self.fetcher.http.shared = None  # no service of this host
+
+    def tearDown(self):
+        os.environ['HOME'] = self.old_home
+        self.fetcher.meta_cache.conn.close()
+        shutil.rmtree(self.home)
+
+
+class DownloadTest(FetchTestCase):
+    """HttpAPOD keeping complete files only"""
+
+    def setUp(self):
+        FetchTestCase.setUp(self)
+        date = self.server.dates[0]
+        self.url = '%simage/%s/picture%s.jpg' % (self.server.get_url(),
+                                                 date.strftime('%y%m'),
+                                                 date.strftime('%y%m%d'))
+        self.path = os.path.join(self.fetcher.cache_dir, 'picture.jpg')
+
+    def fetch(self):
+        """Fetch the picture, return its content and the bytes received"""
+        before = pyAPOD.stats.counters['bytes']
+        path = self.fetcher.http.fetch_file(self.url, self.path)
+        with open(path, 'rb') as picture:
+            return picture.read(), pyAPOD.stats.counters['bytes'] - before
+
+    def test_truncated_fetched_again(self):
+        """A cached file shorter than its download is fetched again"""
+        self.fetch()
+        with open(self.path, 'r+b') as picture:
+            picture.truncate(1000)
+        content, received = self.fetch()
+        self.assertEqual(content, self.server.picture)
+        self.assertEqual(received, len(self.server.picture))
+
+    def test_valid_file_kept(self):
+        """A complete cached file is not fetched again"""
+        self.fetch()
+        content, received = self.fetch()
+        self.assertEqual(content, self.server.picture)
+        self.assertEqual(received, 0)
+
+    def test_part_resumed(self):
+        """A partial download asks only for the rest"""
+        with open(self.path + '.part', 'wb') as part:
+            part.write(self.server.picture[:1000])
+        content, received = self.fetch()
+        self.assertEqual(content, self.server.picture)
+        self.assertEqual(received, len(self.server.picture) - 1000)
+        self.assertFalse(os.path.exists(self.path + '.part'))
+
+
+class PlanDatesTest(FetchTestCase):
+    """FetchAPOD.plan_dates skipping the days without an APOD"""
+
+    def test_no_index(self):
+        """Without the archive index every day is tried"""
+        today = datetime.date.today()
+        self.assertEqual(self.fetcher.plan_dates(today, 3),
+                         [today - datetime.timedelta(days=i)
+                          for i in range(3)])
+
+    def test_indexed(self):
+        """With the index only the dates with an APOD are planned"""
+        self.fetcher.update_date_index()
+        expected = [date for date in self.server.dates
+                    if date not in self.server.gaps][:10]
+        self.assertEqual(self.fetcher.plan_dates(self.server.dates[0], 10),
+                         expected)
+
+    def test_newer_than_index(self):
+        """Days after the newest indexed date are all tried"""
+        self.fetcher.update_date_index()
+        newest = self.server.dates[0]
+        date = newest + datetime.timedelta(days=3)
+        self.assertEqual(self.fetcher.plan_dates(date, 10),
+                         [date - datetime.timedelta(days=i)
+                          for i in range(3)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Tests of the page parser against the recorded pages in tests/pages.
+
+    python -m unittest discover tests
+"""
+
+import os
+import sys
+import unittest
+import StringIO
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+
+import pyAPOD
+
+PAGES_DIR = os.path.join(TESTS_DIR, 'pages')
+
+EXPECTED = {
+    # 1995 layout: upper case tags, a GIF picture
+    'ap950616.html': (
+        'Neutron Star Earth',
+        'image/earthfromneutronstar.GIF',
+        '<p>\n<b>Explanation:</b> What if the Earth were a\n'
+        '<a href="http://example.org/nstars.html">neutron star</a>?\n'
+        'Its gravity would bend light so much that more than half of the\n'
+        'surface could be seen at once.<br />\n'
+        'The continents would look stretched toward the edge.\n</p>'),
+    # 2013 layout: entities decoded in the title, kept in the explanation
+    'ap130505.html': (
+        "The Cat's Eye & Its Halo",
+        'image/1305/catseye_hst_2048.jpg',
+        '<p>\n\n<b> Explanation: </b>\n'
+        'To some, it may look like a cat&#39;s eye.\n'
+        'The alluring <a href="http://example.org/catseye/">Cat&#39;s Eye '
+        'nebula</a>\n'
+        'lies three thousand <a href="http://example.org/ly">light-years'
+        '</a> away\n'
+        'in the constellation of the Dragon (<i>Draco</i>).\n'
+        'Its shells were shed by a dying star some 1,000 years apart '
+        '&mdash;\n'
+        'the faint halo is at least 50,000 years old.<br />\n'
+        '<b>Dat&eacute;: </b> the star is about 4&#215; the Sun.\n</p>'),
+}
+
+
+def open_page(name):
+    """Recorded page as a stream"""
+    return open(os.path.join(PAGES_DIR, name), 'rb')
+
+
+class PageParserTest(unittest.TestCase):
+    """PageParserAPOD on recorded pages"""
+
+    def parse(self, name, chunk_size=None):
+        """Title, picture and explanation of a recorded page"""
+        parser = pyAPOD.PageParserAPOD()
+        if chunk_size is not None:
+            parser.chunk_size = chunk_size
+        with open_page(name) as page:
+            return parser.parse(page)
+
+    def test_pages(self):
+        """Each picture page gives the expected title, link and text"""
+        for name, expected in sorted(EXPECTED.items()):
+            self.assertEqual(self.parse(name), expected, name)
+
+    def test_small_chunks(self):
+        """Tags and entities split between chunks parse the same"""
+        for name, expected in sorted(EXPECTED.items()):
+            self.assertEqual(self.parse(name, 7), expected, name)
+
+    def test_video_day(self):
+        """A video instead of a picture is a page error"""
+        with self.assertRaises(pyAPOD.PageErrorAPOD):
+            self.parse('ap130506.html')
+
+    def test_no_explanation(self):
+        """A page cut before the explanation is a page error"""
+        with open_page('ap130505.html') as page:
+            text = page.read()
+        text = text[:text.index('</center> <p>')]
+        with self.assertRaises(pyAPOD.PageErrorAPOD):
+            pyAPOD.PageParserAPOD().parse(StringIO.StringIO(text))
+
+
+if __name__ == '__main__':
+    unittest.main()